@@ -0,0 +1,116 @@
+import atexit
+import logging
+import threading
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Case, DateTimeField, Value, When
+from django.utils import timezone
+
+from .metrics import unmetered
+from .models import UserProfile
+
+logger = logging.getLogger(__name__)
+
+ONLINE_KEY = 'forum:online'
+
+
+# "Был на форуме": время последнего запроса пользователя запоминается в памяти процесса
+# и записывается в UserProfile.last_activity не чаще раза в FORUM_ACTIVITY_PERSIST_INTERVAL
+# секунд на пользователя — одним UPDATE для всех накопившихся пользователей.
+
+class ActivityTracker:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = {}  # user_id -> время последнего запроса, еще не записанное в базу
+        self._persisted = {}  # user_id -> когда время пользователя последний раз попало в базу
+        self._last_flush = time.time()
+
+    def mark(self, user_id):
+        # Возвращает True, когда пора сбрасывать накопленное в базу
+        now = time.time()
+        interval = settings.FORUM_ACTIVITY_PERSIST_INTERVAL
+        with self._lock:
+            if now - self._persisted.get(user_id, 0) >= interval:
+                self._pending[user_id] = now
+            return now - self._last_flush >= interval
+
+    def seen(self, user_id):
+        if self.mark(user_id):
+            self.flush()
+
+    def pending(self, user_id):
+        return self._pending.get(user_id)
+
+    def flush(self):
+        now = time.time()
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._last_flush = now
+            # Пользователи, записанные больше интервала назад, снова попадут в pending при следующем запросе
+            self._persisted = {user_id: at for user_id, at in self._persisted.items()
+                               if now - at < settings.FORUM_ACTIVITY_PERSIST_INTERVAL}
+            self._persisted.update((user_id, now) for user_id in pending)
+        if not pending:
+            return 0
+        try:
+            with unmetered(), transaction.atomic():
+                self._write(pending)
+        except Exception:
+            with self._lock:
+                for user_id, at in pending.items():
+                    self._pending.setdefault(user_id, at)
+                    self._persisted.pop(user_id, None)
+            # Время запишется следующим сбросом, а запрос, на который пришелся сброс, не падает
+            logger.exception('User activity flush failed, %d users kept for the next flush', len(pending))
+            return 0
+        return len(pending)
+
+    def _write(self, pending):
+        items = list(pending.items())
+        for start in range(0, len(items), settings.FORUM_ACTIVITY_FLUSH_BATCH):
+            batch = items[start:start + settings.FORUM_ACTIVITY_FLUSH_BATCH]
+            seen_at = Case(*[When(user_id=user_id, then=Value(_to_datetime(at))) for user_id, at in batch],
+                           output_field=DateTimeField())
+            UserProfile.objects.filter(user_id__in=[user_id for user_id, _ in batch]).update(
+                last_activity=seen_at)
+
+
+def _to_datetime(timestamp):
+    return datetime.fromtimestamp(timestamp, tz=dt_timezone.utc)
+
+
+tracker = ActivityTracker()
+atexit.register(tracker.flush)
+
+
+def last_seen(profile):
+    # Время из базы или более свежее, еще не записанное этим процессом
+    pending = tracker.pending(profile.user_id)
+    return _to_datetime(pending) if pending else profile.last_activity
+
+
+def _online_queryset():
+    since = timezone.now() - timedelta(seconds=settings.FORUM_ONLINE_WINDOW)
+    return (UserProfile.objects.filter(last_activity__gte=since).order_by('-last_activity')
+            .values('user_id', 'user__username', 'last_activity')[:settings.FORUM_ONLINE_LIMIT])
+
+
+def online_users():
+    # Кто заходил за последние FORUM_ONLINE_WINDOW секунд; список кэшируется ненадолго
+    users = cache.get(ONLINE_KEY)
+    if users is None:
+        users = list(_online_queryset())
+        cache.set(ONLINE_KEY, users, settings.FORUM_ONLINE_CACHE_TTL)
+    return users
+
+
+async def aonline_users():
+    users = await cache.aget(ONLINE_KEY)
+    if users is None:
+        users = [user async for user in _online_queryset()]
+        await cache.aset(ONLINE_KEY, users, settings.FORUM_ONLINE_CACHE_TTL)
+    return users
@@ -1,10 +1,224 @@
-from django.contrib import admin
-from .models import Section, Subsection, Topic, Post, UserProfile, User, Conversation, Message, Ban
-
-admin.site.register(Section)
-admin.site.register(Subsection)
-admin.site.register(Topic)
-admin.site.register(Post)
-admin.site.register(UserProfile)
-admin.site.register(Conversation)
-admin.site.register(Ban)
\ No newline at end of file
+from django import forms
+from django.conf import settings
+from django.contrib import admin, messages
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Max
+from django.shortcuts import render
+from django.utils.functional import cached_property
+
+from . import moderation
+from .models import (Section, Subsection, Topic, Post, UserProfile, User, Conversation, Message, Ban, Warn,
+                     KarmaVote)
+
+
+def estimated_row_count(model, using):
+    # Оценка числа строк без COUNT(*): статистика планировщика в PostgreSQL,
+    # в остальных базах — максимальный id (берется по первичному ключу, верхняя граница)
+    connection = connections[using]
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass', [model._meta.db_table])
+            row = cursor.fetchone()
+        if row and row[0] > 0:
+            return row[0]
+        return None
+    return model._default_manager.using(using).aggregate(max_id=Max('pk'))['max_id']
+
+
+class EstimatedCountPaginator(Paginator):
+    # Для больших таблиц без фильтров админка показывает приблизительное число строк
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            estimate = estimated_row_count(queryset.model, queryset.db)
+            if estimate is not None and estimate > settings.FORUM_ADMIN_EXACT_COUNT_LIMIT:
+                return estimate
+        return super().count
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False  # Без второго COUNT(*) по всей таблице
+
+
+class ModerationActionsMixin:
+    # Права для массовых действий: admin проверяет has_<имя>_permission
+    def has_ban_permission(self, request):
+        return request.user.has_perm('django_forum.add_ban')
+
+    def has_delete_posts_permission(self, request):
+        return request.user.has_perm('django_forum.delete_post')
+
+    def _ban(self, request, user_ids):
+        banned = moderation.ban_users(user_ids, request.user, settings.FORUM_MASS_BAN_DAYS,
+                                      reason='Mass ban from admin')
+        self.message_user(request, f'{banned} users banned for {settings.FORUM_MASS_BAN_DAYS} days.')
+
+
+class CounterFieldsAdminMixin:
+    # Денормализованные счетчики меняются UPDATE с F()-выражениями (counters.py, viewcounts.py, karma.py).
+    # В форме они только для чтения, а изменение объекта сохраняет лишь поля, измененные в форме:
+    # полная запись строки затерла бы параллельные инкременты.
+    def save_model(self, request, obj, form, change):
+        if not change:
+            return super().save_model(request, obj, form, change)
+        concrete = {field.name for field in obj._meta.concrete_fields}
+        obj.save(update_fields=[name for name in form.changed_data if name in concrete])
+
+
+@admin.register(Section)
+class SectionAdmin(CounterFieldsAdminMixin, admin.ModelAdmin):
+    list_display = ('name', 'topic_count', 'post_count', 'last_post_at')
+    readonly_fields = ('topic_count', 'post_count', 'last_post', 'last_post_at')
+
+
+@admin.register(Subsection)
+class SubsectionAdmin(CounterFieldsAdminMixin, admin.ModelAdmin):
+    list_display = ('name', 'section', 'topic_count', 'post_count', 'last_post_at')
+    list_select_related = ('section',)
+    list_filter = ('section',)
+    readonly_fields = ('topic_count', 'post_count', 'last_post', 'last_post_at')
+
+
+class MoveTopicsForm(forms.Form):
+    subsection = forms.ModelChoiceField(queryset=Subsection.objects.select_related('section'))
+
+
+@admin.register(Topic)
+class TopicAdmin(CounterFieldsAdminMixin, ModerationActionsMixin, LargeTableAdmin):
+    list_display = ('id', 'title', 'subsection', 'author', 'is_pinned', 'post_count', 'last_post_at')
+    list_display_links = ('id', 'title')
+    list_select_related = ('subsection', 'author')
+    list_filter = ('subsection', 'is_pinned')  # Оба поля в начале индекса topic_activity_idx
+    raw_id_fields = ('author', 'curator')
+    readonly_fields = ('post_count', 'last_post', 'last_post_at', 'view_count')
+    search_fields = ('=author__username',)
+    actions = ('move_topics', 'delete_topics', 'ban_authors')
+
+    def get_readonly_fields(self, request, obj=None):
+        # Перенос меняет счетчики двух подразделов и их разделов: только действием move_topics
+        fields = super().get_readonly_fields(request, obj)
+        return fields if obj is None else (*fields, 'subsection')
+
+    def get_actions(self, request):
+        # Как и для постов: delete_selected удалял бы топики и их посты поштучно, с сигналами на каждый пост
+        actions = super().get_actions(request)
+        actions.pop('delete_selected', None)
+        return actions
+
+    @admin.action(description='Move selected topics to another subsection', permissions=['change'])
+    def move_topics(self, request, queryset):
+        form = MoveTopicsForm(request.POST if 'apply' in request.POST else None)
+        if form.is_valid():
+            moved = moderation.move_topics(queryset, form.cleaned_data['subsection'])
+            self.message_user(request, f'{moved} topics moved.')
+            return None
+        return render(request, 'admin/django_forum/topic/move_topics.html', {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'form': form,
+            'topics': queryset.select_related(None).only('id', 'title'),
+            'action_checkbox_name': admin.helpers.ACTION_CHECKBOX_NAME,
+        })
+
+    @admin.action(description='Delete selected topics with their posts', permissions=['delete'])
+    def delete_topics(self, request, queryset):
+        deleted = moderation.delete_topics(queryset)
+        self.message_user(request, f'{deleted} topics deleted.')
+
+    @admin.action(description='Ban authors of selected topics', permissions=['ban'])
+    def ban_authors(self, request, queryset):
+        self._ban(request, set(queryset.values_list('author_id', flat=True)))
+
+
+@admin.register(Post)
+class PostAdmin(ModerationActionsMixin, LargeTableAdmin):
+    list_display = ('id', 'topic', 'author', 'created_at')
+    list_select_related = ('topic', 'author')
+    raw_id_fields = ('topic', 'author', 'parent_post')
+    search_fields = ('=author__username',)
+    actions = ('delete_posts', 'delete_authors_posts', 'ban_authors')
+
+    def get_readonly_fields(self, request, obj=None):
+        # Счетчики меняются только при создании и удалении поста, поэтому пост не переносится в другой топик
+        fields = super().get_readonly_fields(request, obj)
+        return fields if obj is None else (*fields, 'topic')
+
+    def get_actions(self, request):
+        # Стандартное delete_selected удаляет поштучно и строит страницу подтверждения по всем связям
+        actions = super().get_actions(request)
+        actions.pop('delete_selected', None)
+        return actions
+
+    @admin.action(description='Delete selected posts', permissions=['delete'])
+    def delete_posts(self, request, queryset):
+        deleted = moderation.delete_posts(queryset)
+        self.message_user(request, f'{deleted} posts deleted.')
+
+    @admin.action(description='Delete ALL posts of the authors of selected posts', permissions=['delete_posts'])
+    def delete_authors_posts(self, request, queryset):
+        deleted = moderation.delete_user_posts(set(queryset.values_list('author_id', flat=True)))
+        self.message_user(request, f'{deleted} posts deleted.', messages.WARNING)
+
+    @admin.action(description='Ban authors of selected posts', permissions=['ban'])
+    def ban_authors(self, request, queryset):
+        self._ban(request, set(queryset.values_list('author_id', flat=True)))
+
+
+@admin.register(UserProfile)
+class UserProfileAdmin(CounterFieldsAdminMixin, ModerationActionsMixin, LargeTableAdmin):
+    list_display = ('user', 'karma', 'last_activity')
+    list_select_related = ('user',)
+    raw_id_fields = ('user',)
+    readonly_fields = ('karma', 'post_count', 'topic_count', 'first_post_at', 'last_post_at', 'warn_count',
+                       'active_ban')
+    search_fields = ('=user__username',)
+    actions = ('ban_users', 'delete_users_posts')
+
+    @admin.action(description='Ban selected users', permissions=['ban'])
+    def ban_users(self, request, queryset):
+        self._ban(request, set(queryset.values_list('user_id', flat=True)))
+
+    @admin.action(description='Delete ALL posts of selected users', permissions=['delete_posts'])
+    def delete_users_posts(self, request, queryset):
+        deleted = moderation.delete_user_posts(set(queryset.values_list('user_id', flat=True)))
+        self.message_user(request, f'{deleted} posts deleted.', messages.WARNING)
+
+
+@admin.register(Conversation)
+class ConversationAdmin(CounterFieldsAdminMixin, LargeTableAdmin):
+    list_display = ('id', 'pair_key', 'last_message_at')
+    raw_id_fields = ('participants',)
+    readonly_fields = ('last_message', 'last_message_at')
+
+
+@admin.register(Message)
+class MessageAdmin(LargeTableAdmin):
+    list_display = ('id', 'conversation_id', 'author', 'created_at')
+    list_select_related = ('author',)
+    raw_id_fields = ('conversation', 'author')
+
+
+@admin.register(Ban)
+class BanAdmin(LargeTableAdmin):
+    list_display = ('id', 'user', 'moderator', 'start_date', 'end_date', 'is_active')
+    list_select_related = ('user', 'moderator')
+    list_filter = ('is_active',)  # Индекс ban_expiry_idx
+    raw_id_fields = ('user', 'moderator')
+    search_fields = ('=user__username',)
+
+
+@admin.register(Warn)
+class WarnAdmin(LargeTableAdmin):
+    list_display = ('id', 'user', 'moderator', 'created_at')
+    list_select_related = ('user', 'moderator')
+    raw_id_fields = ('user', 'moderator')
+
+
+@admin.register(KarmaVote)
+class KarmaVoteAdmin(LargeTableAdmin):
+    list_display = ('id', 'voter', 'target', 'value', 'updated_at')
+    list_select_related = ('voter', 'target')
+    raw_id_fields = ('voter', 'target')
@@ -0,0 +1,9 @@
+from django.apps import AppConfig
+
+
+class ForumConfig(AppConfig):
+    name = 'django_forum'
+    default_auto_field = 'django.db.models.BigAutoField'
+
+    def ready(self):
+        from . import signals  # noqa: F401  Подключаем обработчики сигналов
@@ -13,4 +13,15 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'django_forum.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Импорт после инициализации Django: модулю нужны модели
+from django_forum.qms import websocket_application  # noqa: E402
+
+
+async def application(scope, receive, send):
+    # WebSocket-соединения QMS обслуживаются напрямую, все остальное — Django
+    if scope['type'] == 'websocket':
+        await websocket_application(scope, receive, send)
+    else:
+        await django_application(scope, receive, send)
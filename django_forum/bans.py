@@ -0,0 +1,58 @@
+from datetime import datetime
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Max
+from django.utils import timezone
+
+from . import counters
+from .models import Ban, UserProfile
+
+
+# Проверка «забанен ли пользователь сейчас» с кэшированием результата на пользователя.
+# В кэше лежит время окончания самого долгого активного бана (или 0), поэтому истекший бан
+# перестает действовать сразу, даже если expire_bans еще не выполнялась. Кэш сбрасывается при
+# сохранении и удалении Ban (см. signals.py).
+
+def _cache_key(user_id):
+    return f'forum:ban:{user_id}'
+
+
+def active_ban_until(user_id):
+    key = _cache_key(user_id)
+    until = cache.get(key)
+    if until is None:
+        now = timezone.now()
+        end_date = Ban.objects.filter(user_id=user_id, is_active=True, end_date__gt=now).aggregate(
+            end_date=Max('end_date'))['end_date']
+        until = end_date.timestamp() if end_date else 0
+        cache.set(key, until, settings.FORUM_BAN_CACHE_TTL)
+    return until
+
+
+def banned_until(user):
+    # Время окончания бана (datetime) или None, если пользователь не забанен
+    if not user.is_authenticated:
+        return None
+    until = active_ban_until(user.id)
+    if until and until > timezone.now().timestamp():
+        return datetime.fromtimestamp(until, tz=timezone.get_current_timezone())
+    return None
+
+
+def invalidate(user_id):
+    cache.delete(_cache_key(user_id))
+
+
+def invalidate_many(user_ids):
+    cache.delete_many([_cache_key(user_id) for user_id in user_ids])
+
+
+def expire_bans():
+    # Один UPDATE по индексу (is_active, end_date); кэш не трогаем — там хранится end_date,
+    # и для истекших банов проверка и так дает «не забанен». Профили, где стоял истекший бан,
+    # переключаются на следующий активный бан (или NULL).
+    expired = Ban.objects.filter(is_active=True, end_date__lte=timezone.now()).update(is_active=False)
+    if expired:
+        counters.refresh_active_bans(UserProfile.objects.filter(active_ban__is_active=False))
+    return expired
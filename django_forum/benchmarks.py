@@ -0,0 +1,255 @@
+import asyncio
+import statistics
+import threading
+import time
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from django.db import OperationalError, connection, connections, transaction
+from django.test import AsyncClient, Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLPattern, get_resolver, reverse
+
+from .models import Section, Subsection, Topic, Post, Conversation
+
+# Маршруты, которые не имеет смысла гонять в бенчмарке
+SKIP_URL_NAMES = {'logout', 'metrics'}
+# Параметры запроса для view, которым без них нечего делать
+QUERY_STRINGS = {'search': '?q=python'}
+# Страницы чтения, реализованные как async view (сравнение WSGI и ASGI)
+ASYNC_READ_VIEWS = ('section_list', 'subsection_list', 'topic_list', 'topic_detail', 'forum_stats',
+                    'conversation_list')
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    index = min(len(ordered) - 1, max(0, round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(timings_ms, queries=None):
+    result = {
+        'requests': len(timings_ms),
+        'p50_ms': round(percentile(timings_ms, 0.50), 3),
+        'p95_ms': round(percentile(timings_ms, 0.95), 3),
+        'p99_ms': round(percentile(timings_ms, 0.99), 3),
+        'mean_ms': round(statistics.fmean(timings_ms), 3),
+    }
+    if queries:
+        result['queries_p50'] = percentile(queries, 0.50)
+        result['queries_max'] = max(queries)
+    return result
+
+
+def sample_url_kwargs(user):
+    # Берем для параметров маршрутов самые «тяжелые» объекты: раздел, подраздел и тему с наибольшим числом
+    # сообщений, а также переписку, где участвует пользователь бенчмарка (иначе QMS-view пропускаются)
+    topic = Topic.objects.order_by('-post_count').first()
+    post = Post.objects.filter(topic=topic).order_by('-id').first() if topic else None
+    conversation = Conversation.objects.filter(participants=user).order_by('id').first()
+    subsection = Subsection.objects.order_by('-topic_count').first()
+    section = Section.objects.order_by('-topic_count').first()
+    return {
+        'section_id': section.id if section else None,
+        'subsection_id': subsection.id if subsection else None,
+        'topic_id': topic.id if topic else None,
+        'parent_post_id': post.id if post else None,
+        'conversation_id': conversation.id if conversation else None,
+        'user_id': User.objects.exclude(id=user.id).order_by('id').values_list('id', flat=True).first(),
+    }
+
+
+def _iter_patterns(patterns):
+    for pattern in patterns:
+        # Подключенные через include приложения (админка) в бенчмарк не входят
+        if isinstance(pattern, URLPattern) and pattern.name:
+            yield pattern
+
+
+def benchmark_urls(user):
+    kwargs = sample_url_kwargs(user)
+    urls = {}
+    for pattern in _iter_patterns(get_resolver().url_patterns):
+        if pattern.name in SKIP_URL_NAMES or pattern.name in urls:
+            continue
+        params = {name: kwargs.get(name) for name in pattern.pattern.regex.groupindex}
+        if any(value is None for value in params.values()):
+            continue
+        urls[pattern.name] = reverse(pattern.name, kwargs=params) + QUERY_STRINGS.get(pattern.name, '')
+    return urls
+
+
+def run_view_benchmark(user, iterations, warmup=2, urls=None):
+    client = Client(raise_request_exception=False)  # Ошибка view попадет в отчет как статус 500
+    client.force_login(user)
+    urls = urls or benchmark_urls(user)
+    results = {}
+    for name, url in sorted(urls.items()):
+        for _ in range(warmup):
+            _consume(client.get(url))
+        timings, queries = [], []
+        status = None
+        for _ in range(iterations):
+            with CaptureQueriesContext(connection) as captured:
+                started = time.perf_counter()
+                response = client.get(url)
+                _consume(response)
+                timings.append((time.perf_counter() - started) * 1000)
+            queries.append(len(captured))
+            status = response.status_code
+        results[name] = dict(url=url, status=status, **summarize(timings, queries))
+    return results
+
+
+def _consume(response):
+    if response.streaming:
+        b''.join(response.streaming_content)
+    return response
+
+
+def _worker(operation, deadline, timings, errors):
+    try:
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            try:
+                operation()
+            except OperationalError as exc:  # «database is locked» и подобные
+                errors.append(str(exc))
+                continue
+            timings.append((time.perf_counter() - started) * 1000)
+    finally:
+        connections.close_all()  # Соединения Django привязаны к потоку
+
+
+def run_concurrency_benchmark(topic, author, readers, writers, seconds):
+    """
+    Одновременные читатели (страница постов топика) и писатели (новый пост в транзакции)
+    в течение `seconds` секунд. Возвращает пропускную способность, задержки и ошибки по ролям.
+    Созданные посты остаются в базе, их id возвращаются в 'created_post_ids'.
+    """
+    created = []
+
+    def read():
+        list(Post.objects.filter(topic=topic).select_related('author').order_by('-created_at', '-id')[:50])
+        list(Topic.objects.filter(subsection_id=topic.subsection_id)
+             .order_by('-is_pinned', '-last_post_at', '-id')[:30])
+
+    def write():
+        with transaction.atomic():
+            post = Post.objects.create(topic=topic, author=author, content='benchmark post')
+        created.append(post.id)
+
+    deadline = time.perf_counter() + seconds
+    roles = {'read': (read, readers), 'write': (write, writers)}
+    timings = {role: [] for role in roles}
+    errors = {role: [] for role in roles}
+    threads = [threading.Thread(target=_worker, args=(operation, deadline, timings[role], errors[role]))
+               for role, (operation, count) in roles.items() for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    results = {}
+    for role, (_, count) in roles.items():
+        if not count:
+            continue
+        result = {'threads': count, 'ops_per_second': round(len(timings[role]) / seconds, 1),
+                  'errors': len(errors[role])}
+        if timings[role]:
+            result.update(summarize(timings[role]))
+        if errors[role]:
+            result['first_error'] = errors[role][0]
+        results[role] = result
+    results['created_post_ids'] = created
+    return results
+
+
+def _server_results(concurrency, seconds, samples):
+    # samples — список (имя view, время в мс, статус); ошибкой считается ответ 5xx
+    timings = [elapsed for _, elapsed, _ in samples]
+    results = {'total': {'concurrency': concurrency, 'ops_per_second': round(len(samples) / seconds, 1),
+                         'errors': sum(status >= 500 for _, _, status in samples)}}
+    if timings:
+        results['total'].update(summarize(timings))
+    for name in sorted({name for name, _, _ in samples}):
+        view_timings = [elapsed for view, elapsed, _ in samples if view == name]
+        results[name] = dict(ops_per_second=round(len(view_timings) / seconds, 1), **summarize(view_timings))
+    return results
+
+
+def run_wsgi_benchmark(urls, cookies, concurrency, seconds):
+    """
+    Многопоточный WSGI-сервер: `concurrency` потоков по кругу запрашивают `urls` ({имя: url})
+    через sync-стек обработчика. Возвращает пропускную способность и задержки, общие и по view.
+    """
+    deadline = time.perf_counter() + seconds
+    samples = []
+    items = sorted(urls.items())
+
+    def worker(offset):
+        client = Client(raise_request_exception=False)
+        client.cookies.update(cookies)
+        try:
+            index = offset
+            while time.perf_counter() < deadline:
+                name, url = items[index % len(items)]
+                index += 1
+                started = time.perf_counter()
+                response = _consume(client.get(url))
+                samples.append((name, (time.perf_counter() - started) * 1000, response.status_code))
+        finally:
+            connections.close_all()
+
+    threads = [threading.Thread(target=worker, args=(offset,)) for offset in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return _server_results(concurrency, seconds, samples)
+
+
+def run_asgi_benchmark(urls, cookies, concurrency, seconds):
+    """
+    ASGI-сервер с одним циклом событий (как один воркер uvicorn): `concurrency` одновременных
+    запросов через async-стек обработчика. Sync-код (ORM, sync view) выполняется в потоке sync_to_async.
+    """
+    samples = []
+    items = sorted(urls.items())
+
+    async def worker(offset, deadline):
+        client = AsyncClient(raise_request_exception=False)
+        client.cookies.update(cookies)
+        index = offset
+        while time.perf_counter() < deadline:
+            name, url = items[index % len(items)]
+            index += 1
+            started = time.perf_counter()
+            response = await client.get(url)
+            if response.streaming:
+                await sync_to_async(_consume)(response)
+            samples.append((name, (time.perf_counter() - started) * 1000, response.status_code))
+
+    async def main():
+        deadline = time.perf_counter() + seconds
+        await asyncio.gather(*(worker(offset, deadline) for offset in range(concurrency)))
+        await sync_to_async(connections.close_all)()  # Соединения потока sync_to_async
+
+    asyncio.run(main())
+    return _server_results(concurrency, seconds, samples)
+
+
+def compare(baseline, current):
+    # Отношение текущих p50/p95 и числа запросов к базовым (для сравнения коммитов)
+    diff = {}
+    for name, result in current.items():
+        before = baseline.get(name)
+        if not isinstance(before, dict) or not isinstance(result, dict):
+            continue
+        diff[name] = {
+            key: round(result[key] / before[key], 3) if before.get(key) else None
+            for key in ('p50_ms', 'p95_ms', 'p99_ms', 'queries_max', 'ops_per_second') if key in result
+        }
+    return diff
@@ -0,0 +1,186 @@
+from django.db.models import Count, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import Section, Subsection, Topic, Post, Conversation, Message, UserProfile, Ban, Warn
+
+
+# Денормализованные счетчики тем/постов для Topic, Subsection и Section,
+# последнее сообщение переписки (Conversation.last_message) и агрегаты профиля пользователя.
+# Все изменения делаются одним UPDATE с F()-выражениями, без чтения строки в Python,
+# поэтому параллельные посты не теряют инкременты.
+
+def _containers(topic_id):
+    return (
+        Topic.objects.filter(pk=topic_id),
+        Subsection.objects.filter(topics=topic_id),
+        Section.objects.filter(subsections__topics=topic_id),
+    )
+
+
+def _latest(posts):
+    return posts.order_by('-created_at', '-id')
+
+
+def _topic_activity(topic_posts):
+    # Топик без постов сортируется по времени создания
+    return Coalesce(Subquery(_latest(topic_posts).values('created_at')[:1]), F('created_at'))
+
+
+def post_created(post):
+    for queryset in _containers(post.topic_id):
+        queryset.update(post_count=F('post_count') + 1, last_post=post, last_post_at=post.created_at)
+    UserProfile.objects.filter(user=post.author_id).update(
+        post_count=F('post_count') + 1, last_post_at=post.created_at,
+        first_post_at=Coalesce(F('first_post_at'), Value(post.created_at)))
+
+
+def post_deleted(post):
+    for queryset in _containers(post.topic_id):
+        queryset.update(post_count=F('post_count') - 1)
+    # Первый и последний пост автора — по индексу post_author_idx
+    UserProfile.objects.filter(user=post.author_id).update(post_count=F('post_count') - 1, **_author_post_dates())
+
+    # Если удален последний пост, ForeignKey уже обнулен (SET_NULL) — ищем новый последний пост по индексу
+    topic_posts = Post.objects.filter(topic=OuterRef('pk'))
+    Topic.objects.filter(pk=post.topic_id, last_post__isnull=True).update(
+        last_post=Subquery(_latest(topic_posts).values('id')[:1]),
+        last_post_at=_topic_activity(topic_posts),
+    )
+    subsection_posts = Post.objects.filter(topic__subsection=OuterRef('pk'))
+    Subsection.objects.filter(topics=post.topic_id, last_post__isnull=True).update(
+        last_post=Subquery(_latest(subsection_posts).values('id')[:1]),
+        last_post_at=Subquery(_latest(subsection_posts).values('created_at')[:1]),
+    )
+    section_posts = Post.objects.filter(topic__subsection__section=OuterRef('pk'))
+    Section.objects.filter(subsections__topics=post.topic_id, last_post__isnull=True).update(
+        last_post=Subquery(_latest(section_posts).values('id')[:1]),
+        last_post_at=Subquery(_latest(section_posts).values('created_at')[:1]),
+    )
+
+
+def topic_created(topic):
+    Subsection.objects.filter(pk=topic.subsection_id).update(topic_count=F('topic_count') + 1)
+    Section.objects.filter(subsections=topic.subsection_id).update(topic_count=F('topic_count') + 1)
+    UserProfile.objects.filter(user=topic.author_id).update(topic_count=F('topic_count') + 1)
+
+
+def topic_deleted(topic):
+    # Посты топика удаляются каскадом раньше самого топика и уже вычли себя из post_count
+    Subsection.objects.filter(pk=topic.subsection_id).update(topic_count=F('topic_count') - 1)
+    Section.objects.filter(subsections=topic.subsection_id).update(topic_count=F('topic_count') - 1)
+    UserProfile.objects.filter(user=topic.author_id).update(topic_count=F('topic_count') - 1)
+
+
+def warn_created(warn):
+    UserProfile.objects.filter(user=warn.user_id).update(warn_count=F('warn_count') + 1)
+
+
+def warn_deleted(warn):
+    UserProfile.objects.filter(user=warn.user_id).update(warn_count=F('warn_count') - 1)
+
+
+def refresh_active_bans(profiles):
+    # Бан с самым поздним end_date среди активных, по индексу ban_user_active_idx
+    active = Ban.objects.filter(user=OuterRef('user'), is_active=True, end_date__gt=timezone.now())
+    return profiles.update(active_ban=Subquery(active.order_by('-end_date').values('id')[:1]))
+
+
+def bans_changed(user_ids):
+    return refresh_active_bans(UserProfile.objects.filter(user__in=user_ids))
+
+
+def _author_post_dates():
+    author_posts = Post.objects.filter(author=OuterRef('user'))
+    return {
+        'first_post_at': Subquery(author_posts.order_by('created_at').values('created_at')[:1]),
+        'last_post_at': Subquery(author_posts.order_by('-created_at').values('created_at')[:1]),
+    }
+
+
+def message_created(message):
+    Conversation.objects.filter(pk=message.conversation_id).update(
+        last_message=message, last_message_at=message.created_at)
+
+
+def message_deleted(message):
+    # ForeignKey на удаленное сообщение уже обнулен (SET_NULL)
+    Conversation.objects.filter(pk=message.conversation_id, last_message__isnull=True).update(
+        **_conversation_last_message())
+
+
+def _conversation_last_message():
+    messages = _latest(Message.objects.filter(conversation=OuterRef('pk')))
+    return {
+        'last_message': Subquery(messages.values('id')[:1]),
+        'last_message_at': Coalesce(Subquery(messages.values('created_at')[:1]), F('created_at'), F('last_message_at')),
+    }
+
+
+def _count(queryset, field):
+    return Coalesce(Subquery(
+        queryset.values(field).annotate(total=Count('pk')).values('total')[:1]
+    ), 0)
+
+
+def _sum(queryset, field, column):
+    return Coalesce(Subquery(
+        queryset.values(field).annotate(total=Sum(column)).values('total')[:1]
+    ), 0)
+
+
+def rebuild_counters(topic_ids=None, subsection_ids=None, user_ids=None):
+    # Полный пересчет: по одному UPDATE на таблицу, снизу вверх.
+    # topic_ids/subsection_ids/user_ids ограничивают пересчет затронутыми строками (массовые операции
+    # модерации); разделы пересчитываются те, в которые входят subsection_ids.
+    partial = topic_ids is not None or subsection_ids is not None or user_ids is not None
+    topics = Topic.objects.all() if topic_ids is None else Topic.objects.filter(pk__in=topic_ids)
+    profiles = UserProfile.objects.all() if user_ids is None else UserProfile.objects.filter(user__in=user_ids)
+    subsections = Subsection.objects.all()
+    sections = Section.objects.all()
+    if subsection_ids is not None:
+        subsections = subsections.filter(pk__in=subsection_ids)
+        sections = sections.filter(pk__in=subsections.values('section_id'))
+    elif partial:
+        subsections = subsections.none()
+        sections = sections.none()
+    if partial and topic_ids is None:
+        topics = topics.none()
+    if partial and user_ids is None:
+        profiles = profiles.none()
+
+    topic_posts = Post.objects.filter(topic=OuterRef('pk'))
+    topics.update(
+        post_count=_count(topic_posts, 'topic'),
+        last_post=Subquery(_latest(topic_posts).values('id')[:1]),
+        last_post_at=_topic_activity(topic_posts),
+    )
+
+    subsection_topics = Topic.objects.filter(subsection=OuterRef('pk'))
+    subsection_posts = Post.objects.filter(topic__subsection=OuterRef('pk'))
+    subsections.update(
+        topic_count=_count(subsection_topics, 'subsection'),
+        post_count=_sum(subsection_topics, 'subsection', 'post_count'),
+        last_post=Subquery(_latest(subsection_posts).values('id')[:1]),
+        last_post_at=Subquery(_latest(subsection_posts).values('created_at')[:1]),
+    )
+
+    section_subsections = Subsection.objects.filter(section=OuterRef('pk'))
+    section_posts = Post.objects.filter(topic__subsection__section=OuterRef('pk'))
+    sections.update(
+        topic_count=_sum(section_subsections, 'section', 'topic_count'),
+        post_count=_sum(section_subsections, 'section', 'post_count'),
+        last_post=Subquery(_latest(section_posts).values('id')[:1]),
+        last_post_at=Subquery(_latest(section_posts).values('created_at')[:1]),
+    )
+
+    profiles.update(
+        post_count=_count(Post.objects.filter(author=OuterRef('user')), 'author'),
+        topic_count=_count(Topic.objects.filter(author=OuterRef('user')), 'author'),
+        warn_count=_count(Warn.objects.filter(user=OuterRef('user')), 'user'),
+        **_author_post_dates(),
+    )
+    refresh_active_bans(profiles)
+
+    if not partial:
+        Conversation.objects.update(**_conversation_last_message())
@@ -0,0 +1,28 @@
+import random
+from contextvars import ContextVar
+
+from django.conf import settings
+
+
+# Чтение моделей форума на репликах включается только внутри view из FORUM_REPLICA_VIEWS
+# (см. ReplicaRoutingMiddleware); запись, сессии и пользователи всегда идут в основную базу.
+use_replica = ContextVar('forum_use_replica', default=False)
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        replicas = settings.FORUM_REPLICA_DATABASES
+        if replicas and use_replica.get() and model._meta.app_label == 'django_forum':
+            return random.choice(replicas)
+        return 'default'
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Реплики содержат те же данные, что и основная база
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Схема реплик приходит из основной базы вместе с данными
+        return db == 'default'
@@ -0,0 +1,63 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+from .models import KarmaVote, UserProfile
+from .ratelimit import TokenBucket
+
+
+# Карма: голоса хранятся в KarmaVote (один на пару voter/target), а UserProfile.karma —
+# денормализованная сумма, которая меняется атомарным UPDATE karma = karma + delta.
+
+class SelfVote(ValueError):
+    pass
+
+
+class VoteRateLimited(Exception):
+    pass
+
+
+vote_bucket = TokenBucket('karma', settings.FORUM_KARMA_VOTE_BURST, settings.FORUM_KARMA_VOTE_RATE)
+
+
+def vote(voter, target, value):
+    """
+    Голос voter за target (+1 или -1). Возвращает изменение кармы: 0, если такой голос уже есть,
+    ±2 при смене голоса на противоположный.
+    """
+    if value not in (1, -1):
+        raise ValueError(value)
+    if voter.pk == target.pk:
+        raise SelfVote()
+    if not vote_bucket.consume(voter.pk):
+        raise VoteRateLimited()
+
+    with transaction.atomic():
+        karma_vote, created = KarmaVote.objects.get_or_create(voter=voter, target=target,
+                                                              defaults={'value': value})
+        if created:
+            delta = value
+        elif karma_vote.value == value:
+            return 0
+        else:
+            # Условный UPDATE: если параллельный запрос уже сменил голос, дельту не применяем повторно
+            if not KarmaVote.objects.filter(pk=karma_vote.pk, value=karma_vote.value).update(value=value):
+                return 0
+            delta = value - karma_vote.value
+        UserProfile.objects.filter(user=target).update(karma=F('karma') + delta)
+    return delta
+
+
+def reconcile_karma():
+    # Пересчет кармы всех профилей из журнала голосов одним UPDATE; возвращает число профилей
+    votes = (KarmaVote.objects.filter(target=OuterRef('user')).order_by()
+             .values('target').annotate(total=Sum('value')).values('total'))
+    return UserProfile.objects.update(karma=Coalesce(Subquery(votes), Value(0)))
+
+
+def karma_mismatches():
+    votes = (KarmaVote.objects.filter(target=OuterRef('user')).order_by()
+             .values('target').annotate(total=Sum('value')).values('total'))
+    return (UserProfile.objects.annotate(ledger_karma=Coalesce(Subquery(votes), Value(0)))
+            .exclude(karma=F('ledger_karma')))
@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from django_forum.models import Conversation
+
+
+class Command(BaseCommand):
+    help = 'Заполняет pair_key у существующих личных переписок (ровно два участника)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        through = Conversation.participants.through
+        used = set(Conversation.objects.exclude(pair_key=None).values_list('pair_key', flat=True))
+
+        participants = {}
+        memberships = (through.objects.filter(conversation__pair_key=None)
+                       .order_by('conversation_id').values_list('conversation_id', 'user_id'))
+        for conversation_id, user_id in memberships.iterator(chunk_size=batch_size):
+            participants.setdefault(conversation_id, set()).add(user_id)
+
+        changed = []
+        duplicates = 0
+        for conversation_id, user_ids in participants.items():
+            if len(user_ids) != 2:
+                continue  # Групповая переписка
+            pair_key = Conversation.make_pair_key(*user_ids)
+            if pair_key in used:
+                duplicates += 1  # Старый дубликат личной переписки остается без ключа
+                continue
+            used.add(pair_key)
+            changed.append(Conversation(id=conversation_id, pair_key=pair_key))
+
+        with transaction.atomic():
+            Conversation.objects.bulk_update(changed, ['pair_key'], batch_size=batch_size)
+        self.stdout.write(self.style.SUCCESS(
+            f'{len(changed)} conversations updated, {duplicates} duplicate pairs left without a key.'))
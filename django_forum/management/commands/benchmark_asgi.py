@@ -0,0 +1,67 @@
+import json
+import platform
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from django_forum.benchmarks import (ASYNC_READ_VIEWS, benchmark_urls, compare, run_asgi_benchmark,
+                                     run_wsgi_benchmark)
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает пропускную способность и хвостовые задержки страниц чтения под WSGI '
+            '(потоки, sync-стек) и ASGI (цикл событий, async view) на одних и тех же данных')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=16, help='Одновременных запросов')
+        parser.add_argument('--seconds', type=float, default=10, help='Длительность каждого прогона')
+        parser.add_argument('--user', help='Имя пользователя, от которого выполняются запросы')
+        parser.add_argument('--only', nargs='*', help='Имена URL, которые нужно измерить')
+        parser.add_argument('--output', help='Файл для JSON-отчета (по умолчанию stdout)')
+
+    def handle(self, *args, **options):
+        if options['user']:
+            user = User.objects.filter(username=options['user']).first()
+        else:
+            user = User.objects.filter(is_superuser=True).order_by('id').first() or User.objects.order_by('id').first()
+        if user is None:
+            raise CommandError('No users found, run generate_forum first.')
+
+        # Бюджеты запросов в бенчмарке только измеряются, но не роняют запросы
+        with override_settings(ALLOWED_HOSTS=['testserver'], FORUM_ENFORCE_QUERY_BUDGETS=False):
+            urls = {name: url for name, url in benchmark_urls(user).items()
+                    if name in (options['only'] or ASYNC_READ_VIEWS)}
+            # Одна сессия на все клиенты обоих прогонов
+            client = Client()
+            client.force_login(user)
+            connection.close()
+
+            results = {}
+            for mode, run in (('wsgi', run_wsgi_benchmark), ('asgi', run_asgi_benchmark)):
+                run(urls, client.cookies, options['concurrency'], 1)  # Прогрев кэшей
+                results[mode] = run(urls, client.cookies, options['concurrency'], options['seconds'])
+
+        report = {
+            'created_at': timezone.now().isoformat(),
+            'python': platform.python_version(),
+            'database': connection.vendor,
+            'sqlite_tuning': settings.FORUM_SQLITE_TUNING,
+            'seconds': options['seconds'],
+            'urls': urls,
+            'wsgi': results['wsgi'],
+            'asgi': results['asgi'],
+            # Отношение ASGI к WSGI: >1 по ops_per_second — выигрыш, >1 по задержкам — проигрыш
+            'asgi_vs_wsgi': compare(results['wsgi'], results['asgi']),
+        }
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as output_file:
+                output_file.write(output)
+        else:
+            self.stdout.write(output)
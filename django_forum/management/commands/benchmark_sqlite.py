@@ -0,0 +1,69 @@
+import json
+import platform
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from django_forum import moderation
+from django_forum.benchmarks import compare, run_concurrency_benchmark
+from django_forum.models import Topic
+
+
+class Command(BaseCommand):
+    help = ('Нагрузка одновременными читателями и писателями на SQLite. Для сравнения профилей '
+            'запустите с FORUM_SQLITE_TUNING=0 (--output before.json), затем без него (--compare before.json)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--readers', type=int, default=4)
+        parser.add_argument('--writers', type=int, default=2)
+        parser.add_argument('--seconds', type=float, default=10)
+        parser.add_argument('--keep', action='store_true', help='Не удалять созданные бенчмарком посты')
+        parser.add_argument('--output', help='Файл для JSON-отчета (по умолчанию stdout)')
+        parser.add_argument('--compare', help='JSON-отчет предыдущего прогона для сравнения')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('This benchmark is for the SQLite backend.')
+        topic = Topic.objects.order_by('-post_count').first()
+        author = User.objects.order_by('id').first()
+        if topic is None or author is None:
+            raise CommandError('No topics found, run generate_forum first.')
+
+        if not settings.FORUM_SQLITE_TUNING:
+            # Режим WAL сохраняется в файле базы, для честного «до» возвращаем журнал по умолчанию
+            with connection.cursor() as cursor:
+                cursor.execute('PRAGMA journal_mode = DELETE')
+        connection.close()
+
+        with override_settings(FORUM_ENFORCE_QUERY_BUDGETS=False):
+            results = run_concurrency_benchmark(topic, author, options['readers'], options['writers'],
+                                                options['seconds'])
+        created = results.pop('created_post_ids')
+        if not options['keep']:
+            moderation.delete_posts(topic.posts.filter(pk__in=created))
+
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode')
+            journal_mode = cursor.fetchone()[0]
+        report = {
+            'created_at': timezone.now().isoformat(),
+            'python': platform.python_version(),
+            'sqlite_tuning': settings.FORUM_SQLITE_TUNING,
+            'journal_mode': journal_mode,
+            'seconds': options['seconds'],
+            'workers': results,
+        }
+        if options['compare']:
+            with open(options['compare']) as baseline_file:
+                report['compare'] = compare(json.load(baseline_file)['workers'], results)
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as output_file:
+                output_file.write(output)
+        else:
+            self.stdout.write(output)
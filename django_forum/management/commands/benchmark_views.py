@@ -0,0 +1,56 @@
+import json
+import platform
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from django_forum.benchmarks import benchmark_urls, compare, run_view_benchmark
+
+
+class Command(BaseCommand):
+    help = ('Прогоняет все URL из urls.py через тестовый клиент и выводит p50/p95 задержки '
+            'и число SQL-запросов по каждому view в JSON')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=20)
+        parser.add_argument('--warmup', type=int, default=2)
+        parser.add_argument('--user', help='Имя пользователя, от которого выполняются запросы')
+        parser.add_argument('--only', nargs='*', help='Имена URL, которые нужно измерить')
+        parser.add_argument('--output', help='Файл для JSON-отчета (по умолчанию stdout)')
+        parser.add_argument('--compare', help='JSON-отчет предыдущего прогона для сравнения')
+
+    def handle(self, *args, **options):
+        if options['user']:
+            user = User.objects.filter(username=options['user']).first()
+        else:
+            user = User.objects.filter(is_superuser=True).order_by('id').first() or User.objects.order_by('id').first()
+        if user is None:
+            raise CommandError('No users found, run generate_forum first.')
+
+        # Бюджеты запросов в бенчмарке только измеряются, но не роняют запросы
+        with override_settings(ALLOWED_HOSTS=['testserver'], FORUM_ENFORCE_QUERY_BUDGETS=False):
+            urls = benchmark_urls(user)
+            if options['only']:
+                urls = {name: url for name, url in urls.items() if name in options['only']}
+            results = run_view_benchmark(user, options['iterations'], options['warmup'], urls)
+
+        report = {
+            'created_at': timezone.now().isoformat(),
+            'python': platform.python_version(),
+            'database': connection.vendor,
+            'iterations': options['iterations'],
+            'views': results,
+        }
+        if options['compare']:
+            with open(options['compare']) as baseline_file:
+                report['compare'] = compare(json.load(baseline_file)['views'], results)
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as output_file:
+                output_file.write(output)
+        else:
+            self.stdout.write(output)
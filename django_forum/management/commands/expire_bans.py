@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from django_forum.bans import expire_bans
+
+
+class Command(BaseCommand):
+    help = 'Снимает истекшие баны (is_active=False) одним UPDATE; запускать периодически, например из cron'
+
+    def handle(self, *args, **options):
+        expired = expire_bans()
+        self.stdout.write(self.style.SUCCESS(f'{expired} expired bans deactivated.'))
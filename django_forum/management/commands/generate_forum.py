@@ -0,0 +1,176 @@
+import bisect
+import itertools
+import random
+from datetime import timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from django_forum.counters import rebuild_counters
+from django_forum.models import Section, Subsection, Topic, Post, UserProfile, Warn, Ban, Conversation, Message
+from django_forum import search
+
+WORDS = (
+    'python django sqlite index query cache thread post topic forum reply karma moderator ban warn '
+    'section subsection message conversation latency throughput benchmark cursor page stream '
+    'compiler kernel network memory process scheduler algorithm graph tree hash array linked list'
+).split()
+
+
+class ZipfSampler:
+    # Дискретное распределение Ципфа на 1..maximum: немного огромных тем и длинный хвост коротких
+    def __init__(self, maximum, exponent, rng):
+        weights = [1 / k ** exponent for k in range(1, maximum + 1)]
+        self.cumulative = list(itertools.accumulate(weights))
+        self.rng = rng
+
+    def sample(self):
+        return bisect.bisect_left(self.cumulative, self.rng.random() * self.cumulative[-1]) + 1
+
+
+class Command(BaseCommand):
+    help = 'Генерирует синтетический форум заданного размера для бенчмарков (bulk_create пачками)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--sections', type=int, default=5)
+        parser.add_argument('--subsections', type=int, default=4, help='Подразделов в каждом разделе')
+        parser.add_argument('--topics', type=int, default=1000, help='Всего тем')
+        parser.add_argument('--max-posts', type=int, default=5000, help='Максимум постов в одной теме')
+        parser.add_argument('--zipf', type=float, default=1.2, help='Показатель распределения постов по темам')
+        parser.add_argument('--reply-ratio', type=float, default=0.3, help='Доля постов-ответов')
+        parser.add_argument('--warns', type=int, default=100)
+        parser.add_argument('--bans', type=int, default=20)
+        parser.add_argument('--conversations', type=int, default=300)
+        parser.add_argument('--messages', type=int, default=20, help='Сообщений в переписке (в среднем)')
+        parser.add_argument('--batch-size', type=int, default=2000)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--skip-search-index', action='store_true')
+        parser.add_argument('--skip-render', action='store_true', help='Не строить HTML содержимого заранее')
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+
+        with transaction.atomic():
+            users = self.create_users(options['users'])
+            subsections = self.create_sections(options['sections'], options['subsections'])
+            topics = self.create_topics(options['topics'], subsections, users)
+            self.create_posts(topics, users, options)
+            self.create_moderation(users, options['warns'], options['bans'])
+            self.create_conversations(users, options['conversations'], options['messages'])
+
+        # bulk_create не отправляет сигналы, поэтому денормализованные данные пересчитываются целиком
+        self.stdout.write('Rebuilding counters and post tree...')
+        with transaction.atomic():
+            rebuild_counters()
+        call_command('rebuild_post_tree', stdout=self.stdout)
+        if not options['skip_render']:
+            call_command('rerender_content', stdout=self.stdout)
+        if not options['skip_search_index'] and search.search_available():
+            call_command('rebuild_search_index', stdout=self.stdout)
+        self.stdout.write(self.style.SUCCESS('Forum generated.'))
+
+    def text(self, words):
+        return ' '.join(self.rng.choice(WORDS) for _ in range(words))
+
+    def bulk(self, model, objects):
+        return model.objects.bulk_create(objects, batch_size=self.batch_size)
+
+    def create_users(self, count):
+        password = make_password('benchmark')  # Хэш один на всех, иначе генерация упирается в PBKDF2
+        start = User.objects.count()
+        users = self.bulk(User, [User(username=f'bench_user_{start + i}', password=password) for i in range(count)])
+        self.bulk(UserProfile, [UserProfile(user=user, karma=self.rng.randint(-10, 100)) for user in users])
+        self.stdout.write(f'Users: {len(users)}')
+        return users
+
+    def create_sections(self, sections_count, subsections_per_section):
+        sections = self.bulk(Section, [Section(name=f'Section {i}', description=self.text(12))
+                                       for i in range(sections_count)])
+        subsections = self.bulk(Subsection, [
+            Subsection(section=section, name=f'{section.name}.{i}', description=self.text(8))
+            for section in sections for i in range(subsections_per_section)
+        ])
+        self.stdout.write(f'Sections: {len(sections)}, subsections: {len(subsections)}')
+        return subsections
+
+    def create_topics(self, count, subsections, users):
+        topics = self.bulk(Topic, [
+            Topic(subsection=self.rng.choice(subsections), title=self.text(5).capitalize(), content=self.text(60),
+                  author=self.rng.choice(users))
+            for _ in range(count)
+        ])
+        self.stdout.write(f'Topics: {len(topics)}')
+        return topics
+
+    def create_posts(self, topics, users, options):
+        sampler = ZipfSampler(options['max_posts'], options['zipf'], self.rng)
+        total = 0
+        pending = []
+        for topic in topics:
+            pending.extend(Post(topic=topic, content=self.text(self.rng.randint(5, 80)), author=self.rng.choice(users))
+                           for _ in range(sampler.sample()))
+            if len(pending) >= self.batch_size:
+                total += self.flush_posts(pending, options['reply_ratio'])
+                pending = []
+        total += self.flush_posts(pending, options['reply_ratio'])
+        self.stdout.write(f'Posts: {total}')
+
+    def flush_posts(self, posts, reply_ratio):
+        posts = self.bulk(Post, posts)
+        # Ответы ссылаются на более ранние посты той же темы; id известны после вставки
+        replies = []
+        previous = {}
+        for post in posts:
+            earlier = previous.setdefault(post.topic_id, [])
+            if earlier and self.rng.random() < reply_ratio:
+                post.parent_post_id = self.rng.choice(earlier)
+                replies.append(post)
+            earlier.append(post.id)
+        Post.objects.bulk_update(replies, ['parent_post'], batch_size=self.batch_size)
+        return len(posts)
+
+    def create_moderation(self, users, warns_count, bans_count):
+        moderators = users[:max(1, len(users) // 50)]
+        self.bulk(Warn, [Warn(user=self.rng.choice(users), moderator=self.rng.choice(moderators),
+                              reason=self.text(6)) for _ in range(warns_count)])
+        now = timezone.now()
+        self.bulk(Ban, [
+            Ban(user=self.rng.choice(users), moderator=self.rng.choice(moderators), reason=self.text(6),
+                end_date=now + timedelta(days=self.rng.randint(-30, 30)))
+            for _ in range(bans_count)
+        ])
+        self.stdout.write(f'Warns: {warns_count}, bans: {bans_count}')
+
+    def create_conversations(self, users, count, messages_per_conversation):
+        if len(users) < 2:
+            return
+        # Личные переписки уникальны по паре пользователей (Conversation.pair_key)
+        existing = set(Conversation.objects.exclude(pair_key=None).values_list('pair_key', flat=True))
+        pairs = {}
+        for _ in range(count * 3):
+            if len(pairs) == count:
+                break
+            participants = self.rng.sample(users, 2)
+            pair_key = Conversation.make_pair_key(participants[0].id, participants[1].id)
+            if pair_key not in existing:
+                pairs.setdefault(pair_key, participants)
+
+        conversations = self.bulk(Conversation, [Conversation(pair_key=pair_key) for pair_key in pairs])
+        through = Conversation.participants.through
+        memberships = []
+        messages = []
+        for conversation in conversations:
+            participants = pairs[conversation.pair_key]
+            memberships.extend(through(conversation_id=conversation.id, user_id=user.id) for user in participants)
+            for _ in range(self.rng.randint(1, messages_per_conversation * 2)):
+                messages.append(Message(conversation=conversation, author=self.rng.choice(participants),
+                                        content=self.text(self.rng.randint(3, 40))))
+        self.bulk(through, memberships)
+        self.bulk(Message, messages)
+        self.stdout.write(f'Conversations: {len(conversations)}, messages: {len(messages)}')
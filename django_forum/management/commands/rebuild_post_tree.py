@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from django_forum.models import Topic, Post
+
+
+class Command(BaseCommand):
+    help = 'Заполняет path/depth у постов (дерево ответов) для существующих данных'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        updated = 0
+        for topic_id in Topic.objects.order_by('id').values_list('id', flat=True).iterator():
+            # Родитель всегда создан раньше ответа, поэтому при обходе по id его путь уже известен
+            nodes = {}
+            changed = []
+            for post in Post.objects.filter(topic_id=topic_id).order_by('id').only('id', 'parent_post_id', 'path', 'depth'):
+                parent = nodes.get(post.parent_post_id)
+                path, depth = post.build_path(parent)
+                nodes[post.id] = post
+                if (post.path, post.depth) != (path, depth):
+                    post.path, post.depth = path, depth
+                    changed.append(post)
+            with transaction.atomic():
+                Post.objects.bulk_update(changed, ['path', 'depth'], batch_size=batch_size)
+            updated += len(changed)
+        self.stdout.write(self.style.SUCCESS(f'Post tree rebuilt, {updated} posts updated.'))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from django_forum.search import rebuild_index, search_available
+
+
+class Command(BaseCommand):
+    help = 'Перестраивает полнотекстовый индекс (FTS5) по топикам, постам и сообщениям'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        if not search_available():
+            self.stderr.write('Full-text search requires the SQLite backend.')
+            return
+        with transaction.atomic():
+            rebuild_index(options['batch_size'], log=self.stdout.write)
+        self.stdout.write(self.style.SUCCESS('Search index rebuilt.'))
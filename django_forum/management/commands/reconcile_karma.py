@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from django_forum.karma import karma_mismatches, reconcile_karma
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает карму пользователей из журнала голосов KarmaVote'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Только показать расхождения')
+
+    def handle(self, *args, **options):
+        mismatches = karma_mismatches()
+        if options['dry_run']:
+            for profile in mismatches.select_related('user')[:50]:
+                self.stdout.write(f'{profile.user.username}: {profile.karma} != {profile.ledger_karma}')
+            self.stdout.write(f'{mismatches.count()} profiles differ from the ledger.')
+            return
+        with transaction.atomic():
+            differ = mismatches.count()
+            reconcile_karma()
+        self.stdout.write(self.style.SUCCESS(f'Karma reconciled, {differ} profiles corrected.'))
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from django_forum.markup import RENDERER_VERSION
+from django_forum.models import Topic, Post, Message
+
+
+class Command(BaseCommand):
+    help = 'Строит HTML содержимого топиков, постов и сообщений, у которых устарела версия рендерера'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--all', action='store_true', help='Перерисовать все строки, а не только устаревшие')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        for model in (Topic, Post, Message):
+            queryset = model.objects.all()
+            if not options['all']:
+                queryset = queryset.exclude(content_html_version=RENDERER_VERSION)
+            queryset = queryset.only('id', 'content', 'content_html', 'content_html_version').order_by('id')
+
+            # Пачки по первичному ключу, без OFFSET и без загрузки всей таблицы в память
+            updated = 0
+            last_id = 0
+            while True:
+                batch = list(queryset.filter(id__gt=last_id)[:batch_size])
+                if not batch:
+                    break
+                for obj in batch:
+                    obj.render_content()
+                with transaction.atomic():
+                    model.objects.bulk_update(batch, ['content_html', 'content_html_version'])
+                updated += len(batch)
+                last_id = batch[-1].id
+            self.stdout.write(f'{model.__name__}: {updated} rendered')
+        self.stdout.write(self.style.SUCCESS('Content rendered.'))
@@ -0,0 +1,69 @@
+import re
+
+import bleach
+import mistune
+from bleach.linkifier import Linker
+from django.utils.safestring import mark_safe
+
+
+# Разметка постов, топиков и сообщений: Markdown и основные BBCode-теги.
+# HTML строится один раз при сохранении (RenderedContentMixin в models.py) и хранится вместе
+# с версией рендерера; при изменении правил разметки RENDERER_VERSION увеличивается, старые
+# строки сохраняются заново командой rerender_content, а до того перерисовываются при показе.
+
+RENDERER_VERSION = 1
+
+ALLOWED_TAGS = {
+    'p', 'br', 'hr', 'strong', 'em', 'del', 'u', 'code', 'pre', 'blockquote',
+    'ul', 'ol', 'li', 'a', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6',
+}
+ALLOWED_ATTRIBUTES = {'a': ['href', 'title', 'rel']}
+ALLOWED_PROTOCOLS = {'http', 'https', 'mailto'}
+
+# Исходный HTML экранируется самим Markdown (escape=True), bleach — вторая линия защиты
+_markdown = mistune.create_markdown(escape=True, plugins=['strikethrough'])
+_cleaner = bleach.Cleaner(tags=ALLOWED_TAGS, attributes=ALLOWED_ATTRIBUTES, protocols=ALLOWED_PROTOCOLS,
+                          strip=True)
+_linker = Linker(callbacks=[bleach.callbacks.nofollow, bleach.callbacks.target_blank])
+
+# BBCode переводится в эквивалентный Markdown до разбора
+_BBCODE = [
+    (re.compile(r'\[b\](.+?)\[/b\]', re.I | re.S), r'**\1**'),
+    (re.compile(r'\[i\](.+?)\[/i\]', re.I | re.S), r'*\1*'),
+    (re.compile(r'\[s\](.+?)\[/s\]', re.I | re.S), r'~~\1~~'),
+    (re.compile(r'\[url=([^\]\s]+)\](.+?)\[/url\]', re.I | re.S), r'[\2](\1)'),
+    (re.compile(r'\[url\]([^\[\s]+)\[/url\]', re.I), r'<\1>'),
+]
+_BB_CODE_BLOCK = re.compile(r'\[code\]\n?(.*?)\n?\[/code\]', re.I | re.S)
+_BB_QUOTE = re.compile(r'\[quote(?:=[^\]]*)?\]\n?(.*?)\n?\[/quote\]', re.I | re.S)
+# [u] в Markdown не выражается: заменяем на маркеры, которые после экранирования станут <u>
+_BB_UNDERLINE = re.compile(r'\[u\](.+?)\[/u\]', re.I | re.S)
+_U_OPEN, _U_CLOSE = '\x02u\x03', '\x02/u\x03'
+
+
+def _bbcode_to_markdown(text):
+    text = _BB_CODE_BLOCK.sub(lambda match: f'\n```\n{match.group(1)}\n```\n', text)
+    text = _BB_QUOTE.sub(lambda match: '\n' + '\n'.join('> ' + line for line in match.group(1).splitlines()) + '\n',
+                         text)
+    text = _BB_UNDERLINE.sub(lambda match: _U_OPEN + match.group(1) + _U_CLOSE, text)
+    for pattern, replacement in _BBCODE:
+        text = pattern.sub(replacement, text)
+    return text
+
+
+def render(text):
+    """
+    Текст с разметкой -> безопасный HTML.
+    """
+    html = _markdown(_bbcode_to_markdown(text or ''))
+    html = html.replace(_U_OPEN, '<u>').replace(_U_CLOSE, '</u>')
+    return _linker.linkify(_cleaner.clean(html))
+
+
+def rendered_html(obj):
+    # HTML объекта для шаблона и сериализаторов. Чтение в базу не пишет (страница может читаться
+    # с реплики или из цикла событий): устаревший HTML перерисовывается только в памяти,
+    # а сохраняет его rerender_content
+    if obj.content_html_version != RENDERER_VERSION:
+        obj.render_content()
+    return mark_safe(obj.content_html)
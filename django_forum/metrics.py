@@ -0,0 +1,173 @@
+import bisect
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.template import TemplateDoesNotExist
+from django.template.backends.django import DjangoTemplates, Template, reraise
+
+
+# Метрики запросов: число SQL-запросов, время в БД, время рендеринга шаблонов и общее время.
+# Агрегаты (гистограммы по имени URL) хранятся в памяти процесса и отдаются через /metrics/.
+
+TIME_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200)
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+class RequestMetrics:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+
+    def record_query(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - started
+            self.queries += 1
+
+    @property
+    def wall_time(self):
+        return time.perf_counter() - self.started
+
+
+current_metrics = contextvars.ContextVar('forum_request_metrics', default=None)
+
+
+def record_query(execute, sql, params, many, context):
+    # Обертка ставится на каждое соединение (см. signals.py). Метрики текущего запроса берутся
+    # из contextvar, который копируется и в потоки sync_to_async, где работают соединения async-view.
+    metrics = current_metrics.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    return metrics.record_query(execute, sql, params, many, context)
+
+
+@contextmanager
+def unmetered():
+    # Фоновая работа, которая лишь случайно выполняется внутри запроса (сброс накопленных счетчиков),
+    # не засчитывается в его метрики и бюджет
+    token = current_metrics.set(None)
+    try:
+        yield
+    finally:
+        current_metrics.reset(token)
+
+
+def view_name(request):
+    match = request.resolver_match
+    return (match.url_name or match.view_name) if match else 'unresolved'
+
+
+def query_budget(request):
+    name = view_name(request)
+    if request.method not in ('GET', 'HEAD', 'OPTIONS') and name in settings.FORUM_WRITE_QUERY_BUDGETS:
+        return settings.FORUM_WRITE_QUERY_BUDGETS[name]
+    return settings.FORUM_QUERY_BUDGETS.get(name)
+
+
+def install_query_recorder(connection):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+class Histogram:
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # Последняя корзина — все, что больше верхней границы
+        self.total = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.total += value
+
+    def as_dict(self):
+        buckets = {str(bound): count for bound, count in zip(self.bounds, self.counts)}
+        buckets['+Inf'] = self.counts[-1]
+        return {'buckets': buckets, 'sum': round(self.total, 3)}
+
+
+class ViewStats:
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.budget_violations = 0
+        self.wall_ms = Histogram(TIME_BUCKETS_MS)
+        self.db_ms = Histogram(TIME_BUCKETS_MS)
+        self.template_ms = Histogram(TIME_BUCKETS_MS)
+        self.queries = Histogram(QUERY_BUCKETS)
+
+    def as_dict(self):
+        return {
+            'requests': self.requests,
+            'errors': self.errors,
+            'budget_violations': self.budget_violations,
+            'wall_ms': self.wall_ms.as_dict(),
+            'db_ms': self.db_ms.as_dict(),
+            'template_ms': self.template_ms.as_dict(),
+            'queries': self.queries.as_dict(),
+        }
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._views = {}
+
+    def observe(self, view_name, status, metrics, budget_exceeded=False):
+        with self._lock:
+            stats = self._views.setdefault(view_name, ViewStats())
+            stats.requests += 1
+            if status >= 500:
+                stats.errors += 1
+            if budget_exceeded:
+                stats.budget_violations += 1
+            stats.wall_ms.observe(metrics.wall_time * 1000)
+            stats.db_ms.observe(metrics.db_time * 1000)
+            stats.template_ms.observe(metrics.template_time * 1000)
+            stats.queries.observe(metrics.queries)
+
+    def snapshot(self):
+        with self._lock:
+            return {name: stats.as_dict() for name, stats in sorted(self._views.items())}
+
+    def reset(self):
+        with self._lock:
+            self._views.clear()
+
+
+registry = MetricsRegistry()
+
+
+# Бэкенд шаблонов, засекающий время рендеринга страницы. Вложенные include рендерятся
+# внутри движка и отдельно не учитываются, поэтому время не считается дважды.
+class TimedTemplate(Template):
+    def render(self, context=None, request=None):
+        metrics = current_metrics.get()
+        if metrics is None:
+            return super().render(context, request)
+        started = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            metrics.template_time += time.perf_counter() - started
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    def from_string(self, template_code):
+        return TimedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        try:
+            return TimedTemplate(self.engine.get_template(template_name), self)
+        except TemplateDoesNotExist as exc:
+            reraise(exc, self)
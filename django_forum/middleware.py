@@ -0,0 +1,214 @@
+import logging
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.shortcuts import render
+from django.utils.deprecation import MiddlewareMixin
+
+from .activity import tracker
+from .bans import banned_until
+from .dbrouter import use_replica
+from .metrics import QueryBudgetExceeded, RequestMetrics, current_metrics, query_budget, registry, view_name
+
+logger = logging.getLogger('django_forum.metrics')
+
+
+async def aresolve_user(request):
+    """
+    Пользователь запроса для async-кода, загруженный один раз на запрос.
+    Под ASGI — через request.auser(), который кэширует его и для login_required; результат подставляется
+    в request.user, чтобы sync-код (шаблоны, проверки в sync_to_async) не загружал его повторно.
+    Под WSGI request.user уже загрузили sync-middleware: он только читается (в потоке, на случай
+    если еще не загружен), а не загружается второй раз через auser(). Исключение — login_required
+    на async view: он сам вызывает auser(), и под WSGI это один лишний запрос пользователя.
+    """
+    if isinstance(request, ASGIRequest):
+        request.user = await request.auser()
+    else:
+        await sync_to_async(lambda: request.user.is_authenticated)()
+    return request.user
+
+
+class RequestMetricsMiddleware:
+    """
+    Считает SQL-запросы, время в БД, время рендеринга и общее время каждого запроса,
+    пишет их в лог и в гистограммы по имени URL. При FORUM_ENFORCE_QUERY_BUDGETS запрос чтения,
+    превысивший бюджет запросов своего view (FORUM_QUERY_BUDGETS), завершается ошибкой.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    SAFE_METHODS = {'GET', 'HEAD', 'OPTIONS'}
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        # Для async-стека (ASGI) middleware тоже асинхронный, чтобы long-poll и async view не занимали поток
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        metrics = RequestMetrics()
+        token = current_metrics.set(metrics)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_metrics.reset(token)
+        return self._finish(request, response, metrics)
+
+    async def __acall__(self, request):
+        metrics = RequestMetrics()
+        token = current_metrics.set(metrics)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_metrics.reset(token)
+        return self._finish(request, response, metrics)
+
+    def _finish(self, request, response, metrics):
+        name = view_name(request)
+        budget = query_budget(request)
+        # Запросы потокового ответа выполняются уже после выхода из middleware и здесь не видны
+        budget_exceeded = budget is not None and metrics.queries > budget and not response.streaming
+
+        registry.observe(name, response.status_code, metrics, budget_exceeded)
+        logger.info(
+            'view=%s method=%s status=%s queries=%d db_ms=%.1f template_ms=%.1f wall_ms=%.1f%s',
+            name, request.method, response.status_code, metrics.queries, metrics.db_time * 1000,
+            metrics.template_time * 1000, metrics.wall_time * 1000, ' streaming=1' if response.streaming else '',
+        )
+
+        if budget_exceeded and settings.FORUM_ENFORCE_QUERY_BUDGETS:
+            message = f'{name} ran {metrics.queries} queries, budget is {budget}'
+            # Изменяющий запрос здесь уже закоммичен (счет включает COMMIT и on_commit-обработчики):
+            # ошибка лишь скрыла бы сохраненную запись, поэтому превышение только логируется
+            if request.method not in self.SAFE_METHODS:
+                logger.warning('query budget exceeded: %s', message)
+            else:
+                raise QueryBudgetExceeded(message)
+        return response
+
+
+class BanEnforcementMiddleware(MiddlewareMixin):
+    """
+    Запрещает забаненным пользователям любые изменяющие запросы (POST, PUT, PATCH, DELETE).
+    Чтение не проверяется, а проверка записи — обращение к кэшу без запроса к БД.
+    """
+
+    WRITE_METHODS = {'POST', 'PUT', 'PATCH', 'DELETE'}
+
+    def __init__(self, get_response):
+        super().__init__(get_response)
+        if iscoroutinefunction(self):
+            # В async-стеке чтение пропускается без перехода в поток sync_to_async
+            self.process_view = self.aprocess_view
+
+    def _applies(self, request):
+        if request.method not in self.WRITE_METHODS:
+            return False
+        return not (request.resolver_match and request.resolver_match.url_name in settings.FORUM_BAN_EXEMPT_URLS)
+
+    def _check(self, request):
+        until = banned_until(request.user)
+        if until is not None:
+            return render(request, 'forum/banned.html', {'banned_until': until}, status=403)
+        return None
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        return self._check(request) if self._applies(request) else None
+
+    async def aprocess_view(self, request, view_func, view_args, view_kwargs):
+        if not self._applies(request):
+            return None
+        await aresolve_user(request)
+        return await sync_to_async(self._check)(request)
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Отправляет чтение на реплики для GET-запросов к view из FORUM_REPLICA_VIEWS.
+    После изменяющего запроса пользователь FORUM_REPLICA_PIN_SECONDS секунд читает
+    из основной базы (cookie), чтобы увидеть свои изменения несмотря на отставание реплики.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    PIN_COOKIE = 'forum_primary'
+    SAFE_METHODS = {'GET', 'HEAD', 'OPTIONS'}
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+            self.process_view = self.aprocess_view
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        token = use_replica.set(False)
+        try:
+            response = self.get_response(request)
+        finally:
+            use_replica.reset(token)
+        return self._pin(request, response)
+
+    async def __acall__(self, request):
+        token = use_replica.set(False)
+        try:
+            response = await self.get_response(request)
+        finally:
+            use_replica.reset(token)
+        return self._pin(request, response)
+
+    def _route(self, request):
+        match = request.resolver_match
+        if (settings.FORUM_REPLICA_DATABASES and request.method in self.SAFE_METHODS
+                and match and match.url_name in settings.FORUM_REPLICA_VIEWS
+                and self.PIN_COOKIE not in request.COOKIES):
+            use_replica.set(True)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        self._route(request)
+        return None
+
+    async def aprocess_view(self, request, view_func, view_args, view_kwargs):
+        # Без обращения к базе, поэтому в async-стеке выполняется прямо в цикле событий
+        self._route(request)
+        return None
+
+    def _pin(self, request, response):
+        if settings.FORUM_REPLICA_DATABASES and request.method not in self.SAFE_METHODS:
+            response.set_cookie(self.PIN_COOKIE, '1', max_age=settings.FORUM_REPLICA_PIN_SECONDS,
+                                httponly=True, samesite='Lax')
+        return response
+
+
+class ActivityMiddleware(MiddlewareMixin):
+    """
+    Отмечает время последнего запроса вошедшего пользователя (см. activity.py).
+    Запроса к БД на каждый запрос нет: время копится в памяти и записывается пачками.
+    """
+
+    def __init__(self, get_response):
+        super().__init__(get_response)
+        if iscoroutinefunction(self):
+            self.process_view = self.aprocess_view
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        user = request.user
+        if user.is_authenticated:
+            tracker.seen(user.pk)
+        return None
+
+    async def aprocess_view(self, request, view_func, view_args, view_kwargs):
+        user = await aresolve_user(request)
+        if user.is_authenticated and tracker.mark(user.pk):
+            await sync_to_async(tracker.flush)()
+        return None
@@ -5,12 +5,45 @@ from django.utils import timezone
 from cryptography.fernet import Fernet
 from django.conf import settings
 
+from . import markup
+
+
+# HTML содержимого (content) с разметкой, построенный при сохранении (см. markup.py)
+class RenderedContentMixin(models.Model):
+    content_html = models.TextField(blank=True, default='')  # Очищенный HTML
+    content_html_version = models.PositiveSmallIntegerField(default=0)  # Версия рендерера, 0 — еще не построен
+
+    class Meta:
+        abstract = True
+
+    def render_content(self):
+        self.content_html = markup.render(self.content)
+        self.content_html_version = markup.RENDERER_VERSION
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or 'content' in update_fields:
+            self.render_content()
+            if update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, 'content_html', 'content_html_version'}
+        super().save(*args, **kwargs)
+
+    @property
+    def html(self):
+        return markup.rendered_html(self)
+
 
 # Модель для разделов форума (Section)
 class Section(models.Model):
     name = models.CharField(max_length=100)  # Название раздела
     description = models.TextField(blank=True, null=True)  # Описание раздела
     created_at = models.DateTimeField(auto_now_add=True)  # Время создания раздела
+    # Денормализованные счетчики, обновляются сигналами (см. signals.py)
+    topic_count = models.IntegerField(default=0)  # Количество тем
+    post_count = models.IntegerField(default=0)  # Количество постов
+    last_post_at = models.DateTimeField(null=True, blank=True)  # Время последнего поста
+    last_post = models.ForeignKey('Post', null=True, blank=True, on_delete=models.SET_NULL,
+                                  related_name='+')  # Последний пост
 
     def __str__(self):
         return self.name
@@ -22,13 +55,19 @@ class Subsection(models.Model):
     name = models.CharField(max_length=100)  # Название подраздела
     description = models.TextField(blank=True, null=True)  # Описание подраздела
     created_at = models.DateTimeField(auto_now_add=True)  # Время создания
+    # Денормализованные счетчики, обновляются сигналами (см. signals.py)
+    topic_count = models.IntegerField(default=0)  # Количество тем
+    post_count = models.IntegerField(default=0)  # Количество постов
+    last_post_at = models.DateTimeField(null=True, blank=True)  # Время последнего поста
+    last_post = models.ForeignKey('Post', null=True, blank=True, on_delete=models.SET_NULL,
+                                  related_name='+')  # Последний пост
 
     def __str__(self):
         return self.name
 
 
 # Модель для топиков (Topic)
-class Topic(models.Model):
+class Topic(RenderedContentMixin, models.Model):
     subsection = models.ForeignKey('Subsection', on_delete=models.CASCADE, related_name='topics')  # Связь с подразделом
     title = models.CharField(max_length=200)  # Название топика
     content = models.TextField()  # Содержание топика
@@ -37,6 +76,21 @@ class Topic(models.Model):
     curator = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True,
                                 related_name='curated_topics')  # Куратор
     edited_at = models.DateTimeField(null=True, blank=True)  # Время последнего редактирования
+    is_pinned = models.BooleanField(default=False)  # Закрепленный топик (всегда вверху списка)
+    # Денормализованные счетчики, обновляются сигналами (см. signals.py)
+    post_count = models.IntegerField(default=0)  # Количество постов
+    last_post_at = models.DateTimeField(default=timezone.now)  # Последняя активность: последний пост или создание
+    last_post = models.ForeignKey('Post', null=True, blank=True, on_delete=models.SET_NULL,
+                                  related_name='+')  # Последний пост
+    view_count = models.IntegerField(default=0)  # Просмотры, сбрасываются пачками (см. viewcounts.py)
+
+    class Meta:
+        indexes = [
+            # Список топиков подраздела: закрепленные, затем по последней активности
+            models.Index(fields=['subsection', 'is_pinned', 'last_post_at', 'id'], name='topic_activity_idx'),
+            # То же по популярности
+            models.Index(fields=['subsection', 'is_pinned', 'view_count', 'id'], name='topic_views_idx'),
+        ]
 
     def __str__(self):
         return self.title
@@ -45,34 +99,113 @@ class Topic(models.Model):
         return user.is_superuser or user.is_staff or user == self.author or user == self.curator  # Проверка прав на редактирование
 
 
+# Материализованный путь поста: id всех предков и самого поста в base36 фиксированной ширины.
+# Сортировка по path дает дерево ответов в порядке обхода, поддерево — диапазон по индексу.
+POST_PATH_SEGMENT = 7
+POST_MAX_DEPTH = 32  # Глубже ответы встают рядом с родителем, чтобы path помещался в колонку
+
+
+def post_path_segment(post_id):
+    digits = '0123456789abcdefghijklmnopqrstuvwxyz'
+    segment = ''
+    while post_id:
+        post_id, remainder = divmod(post_id, 36)
+        segment = digits[remainder] + segment
+    return segment.rjust(POST_PATH_SEGMENT, '0')
+
+
 # Модель для постов (Post)
-class Post(models.Model):
+class Post(RenderedContentMixin, models.Model):
     topic = models.ForeignKey('Topic', on_delete=models.CASCADE, related_name='posts')  # Связь с топиком
     content = models.TextField()  # Содержание поста
     created_at = models.DateTimeField(auto_now_add=True)  # Время создания поста
     author = models.ForeignKey(User, on_delete=models.CASCADE)  # Автор поста
     parent_post = models.ForeignKey('self', null=True, blank=True, on_delete=models.SET_NULL,
                                     related_name='replies')  # Ответ на другой пост
+    path = models.CharField(max_length=POST_PATH_SEGMENT * POST_MAX_DEPTH, blank=True, default='')  # Путь в дереве
+    depth = models.PositiveSmallIntegerField(default=0)  # Уровень вложенности ответа
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['topic', 'created_at', 'id'], name='post_topic_keyset_idx'),  # Пагинация топика
+            models.Index(fields=['topic', 'path'], name='post_topic_path_idx'),  # Древовидный вывод
+            models.Index(fields=['author', 'created_at'], name='post_author_idx'),  # Первый/последний пост автора
+        ]
 
     def __str__(self):
         return f'Post by {self.author.username} on {self.created_at}'
 
     def get_absolute_url(self):
-        return f'/topic/{self.topic.id}/#post-{self.id}'  # Ссылка на конкретный пост
+        return f'/topic/{self.topic_id}/?post={self.id}#post-{self.id}'  # Ссылка на страницу с конкретным постом
+
+    def save(self, *args, **kwargs):
+        is_new = self.pk is None
+        super().save(*args, **kwargs)
+        if is_new and not self.path:
+            # id известен только после INSERT, поэтому путь дописываем отдельным UPDATE
+            self.path, self.depth = self.build_path(self.parent_post)
+            Post.objects.filter(pk=self.pk).update(path=self.path, depth=self.depth)
+
+    def build_path(self, parent):
+        segment = post_path_segment(self.id)
+        if parent is None or not parent.path:
+            return segment, 0
+        if parent.depth + 1 >= POST_MAX_DEPTH:
+            return parent.path[:-POST_PATH_SEGMENT] + segment, parent.depth
+        return parent.path + segment, parent.depth + 1
+
+    def subtree(self):
+        # Пост и все ответы на него (на любом уровне) одним запросом по индексу (topic, path)
+        if not self.path:
+            return Post.objects.filter(pk=self.pk)
+        return Post.objects.filter(topic_id=self.topic_id, path__gte=self.path, path__lt=self.path + '~')
 
 
 # Модель для кармы пользователя
 class UserProfile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)  # Связь с пользователем
     karma = models.IntegerField(default=0)  # Карма пользователя
-    last_activity = models.DateTimeField(auto_now=True)  # Последняя активность пользователя
+    # Последняя активность пользователя, обновляется ActivityMiddleware пачками (см. activity.py)
+    last_activity = models.DateTimeField(default=timezone.now)
     telegram_nickname = models.CharField(max_length=50, null=True, blank=True, default=None)  # Telegram ник
     personal_site = models.URLField(null=True, blank=True, default=None)  # Персональный сайт
+    # Денормализованные агрегаты для страницы профиля, обновляются сигналами (см. counters.py)
+    post_count = models.IntegerField(default=0)
+    topic_count = models.IntegerField(default=0)
+    first_post_at = models.DateTimeField(null=True, blank=True)
+    last_post_at = models.DateTimeField(null=True, blank=True)
+    warn_count = models.IntegerField(default=0)
+    # Самый долгий активный бан; после end_date бан считается истекшим и без пересчета
+    active_ban = models.ForeignKey('Ban', null=True, blank=True, on_delete=models.SET_NULL, related_name='+')
+
+    class Meta:
+        indexes = [
+            # Список "сейчас на форуме"
+            models.Index(fields=['last_activity'], name='profile_activity_idx'),
+        ]
 
     def __str__(self):
         return self.user.username
 
 
+# Голоса за карму: один голос (+1 или -1) от пользователя другому, карма в UserProfile — их сумма
+class KarmaVote(models.Model):
+    voter = models.ForeignKey(User, on_delete=models.CASCADE, related_name='karma_votes_given')
+    target = models.ForeignKey(User, on_delete=models.CASCADE, related_name='karma_votes')
+    value = models.SmallIntegerField()  # +1 или -1
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['voter', 'target'], name='karma_vote_unique'),
+            models.CheckConstraint(condition=models.Q(value__in=[-1, 1]), name='karma_vote_value'),
+        ]
+
+    def __str__(self):
+        return f'{self.voter} -> {self.target}: {self.value:+d}'
+
+
 # Модель для варнов (Warn)
 class Warn(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='warns')  # Пользователь, которому выдан варн
@@ -95,6 +228,12 @@ class Ban(models.Model):
     end_date = models.DateTimeField()  # Конец бана
     is_active = models.BooleanField(default=True)  # Активен ли бан
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'is_active', 'end_date'], name='ban_user_active_idx'),  # Проверка бана
+            models.Index(fields=['is_active', 'end_date'], name='ban_expiry_idx'),  # Снятие истекших банов
+        ]
+
     def __str__(self):
         return f'Ban for {self.user.username}'
 
@@ -102,16 +241,69 @@ class Ban(models.Model):
 class Conversation(models.Model):
     participants = models.ManyToManyField(User)  # Участники переписки
     created_at = models.DateTimeField(auto_now_add=True, null=True)
+    # Ключ личной переписки двух пользователей: "меньший_id:больший_id". У групповых переписок NULL.
+    # Уникальный индекс делает поиск O(1) и не дает создать дубликат при одновременных кликах.
+    pair_key = models.CharField(max_length=41, unique=True, null=True, blank=True, default=None)
+    # Последнее сообщение для списка переписок, обновляется сигналами (см. counters.py)
+    last_message = models.ForeignKey('Message', null=True, blank=True, on_delete=models.SET_NULL,
+                                     related_name='+')
+    last_message_at = models.DateTimeField(default=timezone.now)  # Последняя активность: сообщение или создание
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['last_message_at', 'id'], name='conversation_activity_idx'),
+        ]
 
     def __str__(self):
         return f'Conversation {self.id}'
 
+    @staticmethod
+    def make_pair_key(first_user_id, second_user_id):
+        low, high = sorted((first_user_id, second_user_id))
+        return f'{low}:{high}'
+
 
-class Message(models.Model):
+class Message(RenderedContentMixin, models.Model):
     conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name='messages')
     author = models.ForeignKey(User, on_delete=models.CASCADE)
     content = models.TextField()  # Сообщение без шифрования
     created_at = models.DateTimeField(auto_now_add=True, null=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['conversation', 'id'], name='message_conversation_id_idx'),  # Сообщения после id
+        ]
+
     def __str__(self):
         return f'Message from {self.author.username} in conversation {self.conversation.id}'
+
+
+# Отметки о прочтении: одна строка на пользователя и топик/переписку.
+# Для топика маркер — (created_at, id) последнего прочитанного поста, то есть курсор keyset-пагинации.
+class TopicReadState(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='topic_read_states')
+    topic = models.ForeignKey(Topic, on_delete=models.CASCADE, related_name='read_states')
+    last_read_at = models.DateTimeField()  # created_at последнего прочитанного поста
+    last_read_post_id = models.BigIntegerField()  # id последнего прочитанного поста
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'topic'], name='unique_topic_read_state'),
+        ]
+
+    def __str__(self):
+        return f'{self.user_id} read topic {self.topic_id} up to post {self.last_read_post_id}'
+
+
+class ConversationReadState(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='conversation_read_states')
+    conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name='read_states')
+    last_read_message_id = models.BigIntegerField(default=0)  # id последнего прочитанного сообщения
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'conversation'], name='unique_conversation_read_state'),
+        ]
+
+    def __str__(self):
+        return f'{self.user_id} read conversation {self.conversation_id} up to message {self.last_read_message_id}'
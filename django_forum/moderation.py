@@ -0,0 +1,96 @@
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from . import bans, counters, pagecache, search, signals
+from .models import Ban, Post, Topic
+
+
+# Массовые действия модерации. Каждое — несколько запросов на весь набор строк,
+# после которых счетчики пересчитываются только для затронутых топиков и подразделов.
+
+def delete_posts(posts):
+    """
+    Удаляет посты queryset'а; возвращает число удаленных постов.
+    """
+    with transaction.atomic():
+        rows = list(posts.values_list('id', 'topic_id', 'author_id'))
+        if not rows:
+            return 0
+        post_ids = [post_id for post_id, _, _ in rows]
+        topic_ids = {topic_id for _, topic_id, _ in rows}
+        author_ids = {author_id for _, _, author_id in rows}
+        with signals.suspended():
+            # Django удаляет пачками по id и обнуляет ссылки (parent_post, last_post) пачками UPDATE;
+            # загружаем только id, содержимое постов для удаления не нужно
+            Post.objects.filter(pk__in=post_ids).only('id').delete()
+        search.remove_many(search.KIND_POST, post_ids)
+        subsection_ids = set(Topic.objects.filter(pk__in=topic_ids).values_list('subsection_id', flat=True))
+        counters.rebuild_counters(topic_ids=topic_ids, subsection_ids=subsection_ids, user_ids=author_ids)
+        pagecache.bump_subsections(subsection_ids)
+    return len(post_ids)
+
+
+def delete_topics(topics):
+    """
+    Удаляет топики queryset'а вместе с их постами; возвращает число удаленных топиков.
+    """
+    with transaction.atomic():
+        rows = list(topics.values_list('id', 'subsection_id', 'author_id'))
+        if not rows:
+            return 0
+        topic_ids = [topic_id for topic_id, _, _ in rows]
+        subsection_ids = {subsection_id for _, subsection_id, _ in rows}
+        posts = list(Post.objects.filter(topic_id__in=topic_ids).values_list('id', 'author_id'))
+        post_ids = [post_id for post_id, _ in posts]
+        author_ids = {author_id for _, _, author_id in rows} | {author_id for _, author_id in posts}
+        with signals.suspended():
+            # Посты удаляются отдельно и без загрузки содержимого, иначе каскад загрузил бы их целиком
+            Post.objects.filter(pk__in=post_ids).only('id').delete()
+            Topic.objects.filter(pk__in=topic_ids).only('id').delete()
+        search.remove_many(search.KIND_POST, post_ids)
+        search.remove_many(search.KIND_TOPIC, topic_ids)
+        # Сами топики удалены — пересчитываются их подразделы, разделы и профили авторов
+        counters.rebuild_counters(topic_ids=(), subsection_ids=subsection_ids, user_ids=author_ids)
+        pagecache.bump_subsections(subsection_ids)
+    return len(topic_ids)
+
+
+def delete_user_posts(user_ids):
+    return delete_posts(Post.objects.filter(author_id__in=user_ids))
+
+
+def ban_users(user_ids, moderator, days, reason):
+    """
+    Банит пользователей, у которых еще нет активного бана; возвращает число новых банов.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        already_banned = set(Ban.objects.filter(user_id__in=user_ids, is_active=True, end_date__gt=now)
+                             .values_list('user_id', flat=True))
+        new_bans = [Ban(user_id=user_id, moderator=moderator, reason=reason, end_date=now + timedelta(days=days))
+                    for user_id in set(user_ids) - already_banned]
+        Ban.objects.bulk_create(new_bans)
+        # bulk_create не вызывает post_save, поэтому кэш проверки банов и бан в профиле обновляем сами
+        ban_user_ids = [ban.user_id for ban in new_bans]
+        counters.bans_changed(ban_user_ids)
+        transaction.on_commit(lambda: bans.invalidate_many(ban_user_ids))
+    return len(new_bans)
+
+
+def move_topics(topics, subsection):
+    """
+    Переносит топики в другой подраздел одним UPDATE; возвращает число перенесенных топиков.
+    """
+    with transaction.atomic():
+        rows = list(topics.exclude(subsection=subsection).values_list('id', 'subsection_id'))
+        if not rows:
+            return 0
+        topic_ids = [topic_id for topic_id, _ in rows]
+        subsection_ids = {subsection_id for _, subsection_id in rows} | {subsection.pk}
+        Topic.objects.filter(pk__in=topic_ids).update(subsection=subsection)
+        # Счетчики самих топиков не меняются, пересчитываем старые и новый подразделы и их разделы
+        counters.rebuild_counters(topic_ids=(), subsection_ids=subsection_ids)
+        pagecache.bump_subsections(subsection_ids)
+    return len(topic_ids)
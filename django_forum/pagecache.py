@@ -0,0 +1,156 @@
+import hashlib
+import time
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date
+
+from .middleware import aresolve_user
+from .models import Subsection, Topic
+
+
+# Кэш страниц списков (разделы, подразделы, топики) для анонимных посетителей.
+# У форума, каждого раздела и подраздела есть версия — время последнего изменения. Сигналы
+# (signals.py) обновляют версию после коммита, поэтому старые страницы просто перестают
+# находиться по ключу. Версия же дает ETag и Last-Modified: условный GET получает 304
+# без запросов к базе.
+
+def _version_key(scope, object_id=None):
+    return f'forum:version:{scope}' if object_id is None else f'forum:version:{scope}:{object_id}'
+
+
+def get_version(key):
+    # Если версия вытеснена из кэша, считаем, что страница изменилась сейчас
+    return cache.get_or_set(key, time.time, None)
+
+
+async def aget_version(key):
+    return await cache.aget_or_set(key, time.time, None)
+
+
+def _bump(keys):
+    now = time.time()
+    transaction.on_commit(lambda: cache.set_many({key: now for key in keys}, None))
+
+
+def bump_forum():
+    _bump([_version_key('forum')])
+
+
+def bump_section(section_id):
+    _bump([_version_key('section', section_id), _version_key('forum')])
+
+
+def _section_ids(subsection_ids):
+    # Раздел подраздела меняется редко, поэтому соответствие хранится в кэше (сбрасывается в signals.py)
+    keys = {subsection_id: f'forum:subsection-section:{subsection_id}' for subsection_id in subsection_ids}
+    cached = cache.get_many(keys.values())
+    result = {subsection_id: cached[key] for subsection_id, key in keys.items() if key in cached}
+    missing = [subsection_id for subsection_id in keys if subsection_id not in result]
+    if missing:
+        rows = dict(Subsection.objects.filter(pk__in=missing).values_list('id', 'section_id'))
+        cache.set_many({keys[subsection_id]: section_id for subsection_id, section_id in rows.items()}, None)
+        result.update(rows)
+    return result
+
+
+def forget_subsection(subsection_id):
+    cache.delete(f'forum:subsection-section:{subsection_id}')
+
+
+def bump_subsections(subsection_ids):
+    # Изменения в подразделе видны и в списке подразделов его раздела, и на главной
+    keys = [_version_key('forum')]
+    for subsection_id, section_id in _section_ids(subsection_ids).items():
+        keys += [_version_key('subsection', subsection_id), _version_key('section', section_id)]
+    _bump(keys)
+
+
+def bump_topic(topic_id, subsection_id=None):
+    if subsection_id is None:
+        subsection_id = Topic.objects.filter(pk=topic_id).values_list('subsection_id', flat=True).first()
+        if subsection_id is None:
+            return
+    bump_subsections([subsection_id])
+
+
+def _is_anonymous(request):
+    # Без сессионной cookie пользователь точно анонимный — проверяем без обращения к базе
+    if settings.SESSION_COOKIE_NAME not in request.COOKIES:
+        return True
+    return not request.user.is_authenticated
+
+
+async def _ais_anonymous(request):
+    if settings.SESSION_COOKIE_NAME not in request.COOKIES:
+        return True
+    return not (await aresolve_user(request)).is_authenticated
+
+
+def _page_digest(request, version):
+    return hashlib.md5(f'{version}:{request.get_full_path()}'.encode()).hexdigest()
+
+
+def _finish(response, digest, version):
+    response.headers['ETag'] = f'"{digest}"'
+    response.headers['Last-Modified'] = http_date(int(version))
+    # Браузер и прокси должны перепроверять страницу: авторизованные видят другую версию
+    patch_cache_control(response, private=True, max_age=0, must_revalidate=True)
+    patch_vary_headers(response, ('Cookie',))
+    return response
+
+
+def _cacheable(response):
+    return response.status_code == 200 and not response.cookies
+
+
+def cache_anonymous_page(scope, kwarg=None):
+    """
+    Кэширует ответ view для анонимных GET-запросов. Страница зависит от версии
+    scope (forum, section или subsection), id объекта берется из аргумента kwarg.
+    Подходит и для sync, и для async view.
+    """
+    def decorator(view):
+        if iscoroutinefunction(view):
+            @wraps(view)
+            async def async_wrapper(request, *args, **kwargs):
+                if request.method not in ('GET', 'HEAD') or not await _ais_anonymous(request):
+                    return await view(request, *args, **kwargs)
+
+                version = await aget_version(_version_key(scope, kwargs[kwarg] if kwarg else None))
+                digest = _page_digest(request, version)
+                response = get_conditional_response(request, etag=f'"{digest}"', last_modified=int(version))
+                if response is None:
+                    page_key = f'forum:page:{digest}'
+                    response = await cache.aget(page_key)
+                    if response is None:
+                        response = await view(request, *args, **kwargs)
+                        if not _cacheable(response):
+                            return response
+                        await cache.aset(page_key, response, settings.FORUM_PAGE_CACHE_TIMEOUT)
+                return _finish(response, digest, version)
+            return async_wrapper
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD') or not _is_anonymous(request):
+                return view(request, *args, **kwargs)
+
+            version = get_version(_version_key(scope, kwargs[kwarg] if kwarg else None))
+            digest = _page_digest(request, version)
+            response = get_conditional_response(request, etag=f'"{digest}"', last_modified=int(version))
+            if response is None:
+                page_key = f'forum:page:{digest}'
+                response = cache.get(page_key)
+                if response is None:
+                    response = view(request, *args, **kwargs)
+                    if not _cacheable(response):
+                        return response
+                    cache.set(page_key, response, settings.FORUM_PAGE_CACHE_TIMEOUT)
+            return _finish(response, digest, version)
+        return wrapper
+    return decorator
@@ -0,0 +1,192 @@
+import base64
+import binascii
+import datetime
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+
+
+# Keyset (курсорная) пагинация: вместо OFFSET фильтруем по кортежу полей сортировки,
+# поэтому стоимость страницы не зависит от того, насколько глубоко мы листаем.
+
+class InvalidCursor(ValueError):
+    pass
+
+
+class CursorJSONEncoder(DjangoJSONEncoder):
+    # DjangoJSONEncoder обрезает время до миллисекунд, а курсору нужна точность поля
+    def default(self, o):
+        if isinstance(o, datetime.datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+def encode_cursor(values):
+    raw = json.dumps(list(values), cls=CursorJSONEncoder, separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(model, ordering, cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise InvalidCursor(cursor)
+    if not isinstance(values, list) or len(values) != len(ordering):
+        raise InvalidCursor(cursor)
+    # Приводим значения из JSON обратно к типам полей (datetime, bool, int)
+    result = []
+    for name, value in zip(ordering, values):
+        field = model._meta.get_field(name.lstrip('-'))
+        try:
+            result.append(field.to_python(value))
+        except Exception:
+            raise InvalidCursor(cursor)
+    return result
+
+
+def cursor_values(obj, ordering):
+    return [getattr(obj, name.lstrip('-')) for name in ordering]
+
+
+def _reverse_ordering(ordering):
+    return [name[1:] if name.startswith('-') else '-' + name for name in ordering]
+
+
+def keyset_filter(ordering, values, inclusive=False):
+    # (a, b, c) > (x, y, z)  ==>  a > x OR (a = x AND b > y) OR (a = x AND b = y AND c > z)
+    condition = Q()
+    equal = Q()
+    last = len(ordering) - 1
+    for index, (name, value) in enumerate(zip(ordering, values)):
+        field = name.lstrip('-')
+        lookup = 'lt' if name.startswith('-') else 'gt'
+        if inclusive and index == last:
+            lookup += 'e'
+        condition |= equal & Q(**{f'{field}__{lookup}': value})
+        equal &= Q(**{field: value})
+    return condition
+
+
+class KeysetPage:
+    def __init__(self, items, next_cursor=None, previous_cursor=None):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.items)
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+
+def keyset_queryset(queryset, ordering, after=None, start=None):
+    qs = queryset.order_by(*ordering)
+    if after is not None:
+        qs = qs.filter(keyset_filter(ordering, decode_cursor(queryset.model, ordering, after)))
+    elif start is not None:
+        qs = qs.filter(keyset_filter(ordering, start, inclusive=True))
+    return qs
+
+
+def _has_previous(queryset, ordering, after, start):
+    if after is not None:
+        return True
+    if start is not None:
+        return queryset.filter(keyset_filter(_reverse_ordering(ordering), start)).exists()
+    return False
+
+
+async def _ahas_previous(queryset, ordering, after, start):
+    if after is not None:
+        return True
+    if start is not None:
+        return await queryset.filter(keyset_filter(_reverse_ordering(ordering), start)).aexists()
+    return False
+
+
+def _page_queryset(queryset, ordering, per_page, after, before, start, last):
+    # Запрос страницы с одной лишней записью (по ней видно, есть ли следующая) и направление
+    if before is not None or last:
+        # Листаем назад: переворачиваем сортировку, а затем и результат
+        reverse = _reverse_ordering(ordering)
+        qs = queryset.order_by(*reverse)
+        if before is not None:
+            qs = qs.filter(keyset_filter(reverse, decode_cursor(queryset.model, ordering, before)))
+        return qs[:per_page + 1], True
+    return keyset_queryset(queryset, ordering, after, start)[:per_page + 1], False
+
+
+def _backward_page(items, ordering, per_page, before):
+    has_previous = len(items) > per_page
+    items = items[:per_page]
+    items.reverse()
+    if not items:
+        return KeysetPage(items)
+    return KeysetPage(
+        items,
+        next_cursor=encode_cursor(cursor_values(items[-1], ordering)) if before is not None else None,
+        previous_cursor=encode_cursor(cursor_values(items[0], ordering)) if has_previous else None,
+    )
+
+
+def _forward_page(items, ordering, per_page, has_previous):
+    has_next = len(items) > per_page
+    items = items[:per_page]
+    if not items:
+        return KeysetPage(items)
+    return KeysetPage(
+        items,
+        next_cursor=encode_cursor(cursor_values(items[-1], ordering)) if has_next else None,
+        previous_cursor=encode_cursor(cursor_values(items[0], ordering)) if has_previous else None,
+    )
+
+
+def keyset_paginate(queryset, ordering, per_page, after=None, before=None, start=None, last=False):
+    """
+    Одна страница queryset, отсортированного по `ordering` (последнее поле должно быть уникальным).
+
+    after/before — курсоры соседних страниц, start — значения полей первой записи
+    страницы (включительно), last — последняя страница.
+    """
+    ordering = list(ordering)
+    qs, backward = _page_queryset(queryset, ordering, per_page, after, before, start, last)
+    items = list(qs)
+    if backward:
+        return _backward_page(items, ordering, per_page, before)
+    has_previous = bool(items) and _has_previous(queryset, ordering, after, start)
+    return _forward_page(items, ordering, per_page, has_previous)
+
+
+async def akeyset_paginate(queryset, ordering, per_page, after=None, before=None, start=None, last=False):
+    # То же для async view
+    ordering = list(ordering)
+    qs, backward = _page_queryset(queryset, ordering, per_page, after, before, start, last)
+    items = [item async for item in qs]
+    if backward:
+        return _backward_page(items, ordering, per_page, before)
+    has_previous = bool(items) and await _ahas_previous(queryset, ordering, after, start)
+    return _forward_page(items, ordering, per_page, has_previous)
+
+
+def keyset_stream(queryset, ordering, per_page, after=None, start=None):
+    # Для потоковой отдачи: записи страницы не загружаются в память, а границы
+    # страницы (курсоры) вычисляются двумя короткими запросами по индексу
+    ordering = list(ordering)
+    fields = [name.lstrip('-') for name in ordering]
+    qs = keyset_queryset(queryset, ordering, after, start)
+
+    first = qs.values_list(*fields).first()
+    if first is None:
+        return KeysetPage(qs.none())
+    boundary = list(qs.values_list(*fields)[per_page - 1:per_page + 1])
+    next_cursor = encode_cursor(boundary[0]) if len(boundary) > 1 else None
+    previous_cursor = encode_cursor(first) if _has_previous(queryset, ordering, after, start) else None
+    return KeysetPage(qs[:per_page], next_cursor, previous_cursor)
@@ -0,0 +1,98 @@
+import asyncio
+import functools
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.module_loading import import_string
+
+
+# Уведомления о новых сообщениях QMS. Канал — id переписки, значение — id последнего сообщения;
+# сами сообщения подписчик дочитывает из БД. Реализация выбирается настройкой FORUM_PUBSUB_HUB.
+
+class InProcessHub:
+    """
+    Хаб в памяти процесса: publish() можно вызывать из любого потока (sync-view, сигналы),
+    ожидающие корутины будятся через call_soon_threadsafe своего event loop.
+    Подходит для одного воркера; для нескольких — CacheHub.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._latest = {}
+        self._waiters = {}
+
+    def publish(self, channel, value):
+        with self._lock:
+            if value > self._latest.get(channel, 0):
+                self._latest[channel] = value
+            waiters = self._waiters.pop(channel, [])
+        for loop, future in waiters:
+            loop.call_soon_threadsafe(_resolve, future, value)
+
+    async def wait(self, channel, after, timeout):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        with self._lock:
+            # Сначала регистрируемся, потом проверяем последнее значение — так публикация не потеряется
+            latest = self._latest.get(channel, 0)
+            if latest > after:
+                return latest
+            self._waiters.setdefault(channel, []).append((loop, future))
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            with self._lock:
+                waiters = self._waiters.get(channel)
+                if waiters and (loop, future) in waiters:
+                    waiters.remove((loop, future))
+                    if not waiters:
+                        del self._waiters[channel]
+
+
+def _resolve(future, value):
+    if not future.done():
+        future.set_result(value)
+
+
+class CacheHub:
+    """
+    Заменитель внешнего брокера: последнее значение канала хранится в общем кэше
+    (FileBasedCache, Memcached, Redis), подписчики опрашивают его с интервалом
+    FORUM_PUBSUB_POLL_INTERVAL. Работает между воркерами и процессами.
+    """
+
+    def __init__(self, alias=None):
+        self.cache = caches[alias or settings.FORUM_PUBSUB_CACHE]
+
+    def _key(self, channel):
+        return f'forum:pubsub:{channel}'
+
+    def publish(self, channel, value):
+        key = self._key(channel)
+        if not self.cache.add(key, value, None) and (self.cache.get(key) or 0) < value:
+            self.cache.set(key, value, None)
+
+    async def wait(self, channel, after, timeout):
+        deadline = time.monotonic() + timeout
+        key = self._key(channel)
+        while True:
+            latest = await self.cache.aget(key)
+            if latest is not None and latest > after:
+                return latest
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            await asyncio.sleep(min(settings.FORUM_PUBSUB_POLL_INTERVAL, remaining))
+
+
+@functools.lru_cache(maxsize=None)
+def get_hub():
+    return import_string(settings.FORUM_PUBSUB_HUB)()
+
+
+def conversation_channel(conversation_id):
+    return f'conversation:{conversation_id}'
@@ -0,0 +1,166 @@
+import asyncio
+import json
+import re
+from http.cookies import SimpleCookie
+from types import SimpleNamespace
+from urllib.parse import parse_qs, urlsplit
+
+from django.conf import settings
+from django.contrib.auth import aget_user
+from django.http.request import split_domain_port, validate_host
+from django.utils.module_loading import import_string
+
+from .models import Conversation, Message
+from .pubsub import conversation_channel, get_hub
+
+
+# Доставка сообщений QMS в реальном времени: WebSocket-приложение для asgi.py
+# и общие функции выборки/сериализации, которые использует long-poll view.
+
+WEBSOCKET_PATH = re.compile(r'^/qms/conversation/(?P<conversation_id>\d+)/ws/$')
+
+
+def serialize_message(message):
+    return {
+        'id': message.id,
+        'author_id': message.author_id,
+        'author': message.author.username,
+        'content': message.content,
+        'html': message.html,
+        'created_at': message.created_at.isoformat() if message.created_at else None,
+    }
+
+
+def messages_window(conversation_id, after=None, before=None, limit=50):
+    """
+    Окно сообщений переписки по индексу (conversation, id): после `after`, перед `before`
+    или последние `limit`. Берется на одну запись больше, чтобы понять, есть ли продолжение.
+    Возвращает (queryset, backward); при backward=True записи идут от новых к старым.
+    """
+    queryset = Message.objects.filter(conversation_id=conversation_id).select_related('author')
+    if after is not None:
+        return queryset.filter(id__gt=after).order_by('id')[:limit + 1], False
+    if before is not None:
+        queryset = queryset.filter(id__lt=before)
+    return queryset.order_by('-id')[:limit + 1], True
+
+
+def _window_result(messages, backward, limit):
+    has_more = len(messages) > limit
+    messages = messages[:limit]
+    if backward:
+        messages.reverse()
+    return messages, has_more
+
+
+def fetch_messages(conversation_id, after=None, before=None, limit=50):
+    queryset, backward = messages_window(conversation_id, after, before, limit)
+    return _window_result(list(queryset), backward, limit)
+
+
+async def afetch_messages(conversation_id, after=None, before=None, limit=50):
+    queryset, backward = messages_window(conversation_id, after, before, limit)
+    return _window_result([message async for message in queryset], backward, limit)
+
+
+async def afetch_messages_after(conversation_id, after, limit):
+    messages, _ = await afetch_messages(conversation_id, after=after, limit=limit)
+    return [serialize_message(message) for message in messages]
+
+
+def is_participant(user, conversation_id):
+    return user.is_authenticated and Conversation.objects.filter(id=conversation_id, participants=user).exists()
+
+
+async def ais_participant(user, conversation_id):
+    if not user.is_authenticated:
+        return False
+    return await Conversation.objects.filter(id=conversation_id, participants=user).aexists()
+
+
+def _header(scope, name):
+    for key, value in scope.get('headers', []):
+        if key == name:
+            return value.decode('latin-1')
+    return None
+
+
+def is_allowed_origin(origin):
+    """
+    Проверка Origin для WebSocket: браузер передает сессионную cookie в сокет с любого сайта,
+    а CSRF-токена у рукопожатия нет. Origin допускается, если он есть в CSRF_TRUSTED_ORIGINS
+    или его хост разрешен ALLOWED_HOSTS (с теми же значениями по умолчанию для DEBUG, что и в get_host).
+    """
+    if not origin or origin == 'null':
+        return False
+    if origin in settings.CSRF_TRUSTED_ORIGINS:
+        return True
+    parsed = urlsplit(origin)
+    for trusted in settings.CSRF_TRUSTED_ORIGINS:
+        trusted = urlsplit(trusted)
+        if '*' in trusted.netloc and trusted.scheme == parsed.scheme \
+                and validate_host(parsed.netloc, [trusted.netloc.replace('*', '', 1)]):
+            return True
+    domain, port = split_domain_port(parsed.netloc)
+    allowed_hosts = settings.ALLOWED_HOSTS
+    if settings.DEBUG and not allowed_hosts:
+        allowed_hosts = ['.localhost', '127.0.0.1', '[::1]']
+    return bool(domain) and validate_host(domain, allowed_hosts)
+
+
+async def _websocket_user(scope):
+    # Пользователь определяется по сессионной cookie, как и в обычных view
+    cookies = SimpleCookie()
+    for name, value in scope.get('headers', []):
+        if name == b'cookie':
+            cookies.load(value.decode('latin-1'))
+    morsel = cookies.get(settings.SESSION_COOKIE_NAME)
+    session = import_string(settings.SESSION_ENGINE + '.SessionStore')(morsel.value if morsel else None)
+    return await aget_user(SimpleNamespace(session=session))
+
+
+async def websocket_application(scope, receive, send):
+    match = WEBSOCKET_PATH.match(scope['path'])
+    if match is None:
+        await send({'type': 'websocket.close', 'code': 4404})
+        return
+    conversation_id = int(match['conversation_id'])
+
+    message = await receive()
+    if message['type'] != 'websocket.connect':
+        return
+    if not is_allowed_origin(_header(scope, b'origin')):
+        await send({'type': 'websocket.close', 'code': 4403})
+        return
+    user = await _websocket_user(scope)
+    if not await ais_participant(user, conversation_id):
+        await send({'type': 'websocket.close', 'code': 4403})
+        return
+    await send({'type': 'websocket.accept'})
+
+    query = parse_qs(scope.get('query_string', b'').decode())
+    try:
+        after = int(query.get('after', ['0'])[0])
+    except ValueError:
+        after = 0
+
+    async def wait_disconnect():
+        while (await receive())['type'] != 'websocket.disconnect':
+            pass  # Клиент ничего не отправляет, сообщения пишутся обычным POST
+
+    hub = get_hub()
+    channel = conversation_channel(conversation_id)
+    disconnect = asyncio.ensure_future(wait_disconnect())
+    try:
+        while not disconnect.done():
+            batch = await afetch_messages_after(conversation_id, after, settings.FORUM_QMS_BATCH_SIZE)
+            if batch:
+                after = batch[-1]['id']
+                await send({'type': 'websocket.send', 'text': json.dumps({'messages': batch})})
+                if len(batch) == settings.FORUM_QMS_BATCH_SIZE:
+                    continue  # Есть еще непрочитанные, дочитываем без ожидания
+            waiter = asyncio.ensure_future(hub.wait(channel, after, settings.FORUM_QMS_WAIT_TIMEOUT))
+            await asyncio.wait({waiter, disconnect}, return_when=asyncio.FIRST_COMPLETED)
+            waiter.cancel()
+    finally:
+        disconnect.cancel()
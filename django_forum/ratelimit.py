@@ -0,0 +1,33 @@
+import time
+
+from django.core.cache import cache
+
+
+# Token bucket поверх кэша Django: ведро вмещает `capacity` токенов и пополняется
+# со скоростью `refill_rate` токенов в секунду. Состояние — пара (токены, время) на ключ.
+# Чтение и запись не атомарны, поэтому при гонке между процессами возможен лишний пропуск;
+# для ограничения частоты действий пользователя этого достаточно.
+
+class TokenBucket:
+    def __init__(self, name, capacity, refill_rate):
+        self.name = name
+        self.capacity = capacity
+        self.refill_rate = refill_rate
+
+    def _key(self, ident):
+        return f'forum:ratelimit:{self.name}:{ident}'
+
+    def consume(self, ident, tokens=1):
+        key = self._key(ident)
+        now = time.time()
+        available, updated_at = cache.get(key, (self.capacity, now))
+        available = min(self.capacity, available + (now - updated_at) * self.refill_rate)
+        allowed = available >= tokens
+        if allowed:
+            available -= tokens
+        # Ведро целиком пополнится за capacity / refill_rate секунд, дольше хранить состояние незачем
+        cache.set(key, (available, now), int(self.capacity / self.refill_rate) + 1)
+        return allowed
+
+    def reset(self, ident):
+        cache.delete(self._key(ident))
@@ -0,0 +1,98 @@
+from django.db.models import Case, Count, IntegerField, OuterRef, Q, Subquery, Value, When
+from django.db.models.functions import Coalesce
+
+from .models import Post, Message, TopicReadState, ConversationReadState
+
+
+# Непрочитанные топики и переписки. Маркер двигается только вперед: UPDATE с условием
+# «старый маркер меньше нового», а если строки еще нет — INSERT с игнорированием конфликта.
+
+def get_topic_read_state(user, topic):
+    if not user.is_authenticated:
+        return None
+    return TopicReadState.objects.filter(user=user, topic=topic).first()
+
+
+async def aget_topic_read_state(user, topic):
+    if not user.is_authenticated:
+        return None
+    return await TopicReadState.objects.filter(user=user, topic=topic).afirst()
+
+
+def _is_read(state, post):
+    return state is not None and (state.last_read_at, state.last_read_post_id) >= (post.created_at, post.id)
+
+
+def _older_than(post):
+    return Q(last_read_at__lt=post.created_at) | Q(last_read_at=post.created_at, last_read_post_id__lt=post.id)
+
+
+def mark_topic_read(user, topic, post, state=None):
+    if _is_read(state, post):
+        return  # Эта страница уже прочитана, запись не нужна
+    updated = TopicReadState.objects.filter(_older_than(post), user=user, topic=topic).update(
+        last_read_at=post.created_at, last_read_post_id=post.id)
+    if not updated and state is None:
+        TopicReadState.objects.bulk_create(
+            [TopicReadState(user=user, topic=topic, last_read_at=post.created_at, last_read_post_id=post.id)],
+            ignore_conflicts=True,
+        )
+
+
+async def amark_topic_read(user, topic, post, state=None):
+    if _is_read(state, post):
+        return
+    updated = await TopicReadState.objects.filter(_older_than(post), user=user, topic=topic).aupdate(
+        last_read_at=post.created_at, last_read_post_id=post.id)
+    if not updated and state is None:
+        await TopicReadState.objects.abulk_create(
+            [TopicReadState(user=user, topic=topic, last_read_at=post.created_at, last_read_post_id=post.id)],
+            ignore_conflicts=True,
+        )
+
+
+def mark_conversation_read(user, conversation, message_id):
+    updated = ConversationReadState.objects.filter(
+        user=user, conversation=conversation, last_read_message_id__lt=message_id,
+    ).update(last_read_message_id=message_id)
+    if not updated:
+        ConversationReadState.objects.bulk_create(
+            [ConversationReadState(user=user, conversation=conversation, last_read_message_id=message_id)],
+            ignore_conflicts=True,
+        )
+
+
+def _count(queryset, group_by):
+    return Subquery(queryset.order_by().values(group_by).annotate(total=Count('pk')).values('total')[:1])
+
+
+def annotate_topic_unread(topics, user):
+    # Одним запросом: маркер пользователя и число постов после него (диапазон по индексу topic, created_at, id).
+    # Непрочитанный ни разу топик целиком новый — берем денормализованный post_count без подзапроса.
+    if not user.is_authenticated:
+        return topics
+    state = TopicReadState.objects.filter(user=user, topic=OuterRef('pk'))
+    topics = topics.annotate(
+        last_read_at=Subquery(state.values('last_read_at')[:1]),
+        last_read_post_id=Subquery(state.values('last_read_post_id')[:1]),
+    )
+    unread_posts = Post.objects.filter(topic=OuterRef('pk')).filter(
+        Q(created_at__gt=OuterRef('last_read_at'))
+        | Q(created_at=OuterRef('last_read_at'), id__gt=OuterRef('last_read_post_id'))
+    )
+    return topics.annotate(unread_count=Case(
+        When(last_read_at__isnull=True, then='post_count'),
+        default=Coalesce(_count(unread_posts, 'topic'), 0),
+        output_field=IntegerField(),
+    ))
+
+
+def annotate_conversation_unread(conversations, user):
+    last_read = ConversationReadState.objects.filter(user=user, conversation=OuterRef('pk'))
+    conversations = conversations.annotate(
+        last_read_message_id=Coalesce(Subquery(last_read.values('last_read_message_id')[:1]), Value(0)),
+    )
+    unread_messages = Message.objects.filter(
+        conversation=OuterRef('pk'), id__gt=OuterRef('last_read_message_id'),
+    ).exclude(author=user)
+    return conversations.annotate(unread_count=Coalesce(_count(unread_messages, 'conversation'), 0))
@@ -0,0 +1,72 @@
+from django.conf import settings
+from django.core.cache import cache
+
+
+# Роли пользователя на форуме (группы Admin и Moderator). Вычисляются одним запросом и кэшируются:
+# на объекте пользователя — до конца запроса, в кэше Django — до изменения членства в группах
+# (см. signals.py). Поколение в ключе кэша позволяет сбросить роли всех пользователей сразу,
+# когда меняется сама группа.
+
+MODERATOR_GROUPS = ('Admin', 'Moderator')
+
+_GENERATION_KEY = 'forum:roles:generation'
+
+
+def _cache_key(user_id):
+    generation = cache.get_or_set(_GENERATION_KEY, 0, None)
+    return f'forum:roles:{generation}:{user_id}'
+
+
+async def _acache_key(user_id):
+    generation = await cache.aget_or_set(_GENERATION_KEY, 0, None)
+    return f'forum:roles:{generation}:{user_id}'
+
+
+def get_roles(user):
+    if not user.is_authenticated:
+        return frozenset()
+    roles = getattr(user, '_forum_roles', None)
+    if roles is None:
+        key = _cache_key(user.id)
+        names = cache.get(key)
+        if names is None:
+            names = list(user.groups.filter(name__in=MODERATOR_GROUPS).values_list('name', flat=True))
+            cache.set(key, names, settings.FORUM_ROLES_CACHE_TTL)
+        roles = user._forum_roles = frozenset(names)
+    return roles
+
+
+async def aget_roles(user):
+    if not user.is_authenticated:
+        return frozenset()
+    roles = getattr(user, '_forum_roles', None)
+    if roles is None:
+        key = await _acache_key(user.id)
+        names = await cache.aget(key)
+        if names is None:
+            names = [name async for name in user.groups.filter(name__in=MODERATOR_GROUPS)
+                     .values_list('name', flat=True)]
+            await cache.aset(key, names, settings.FORUM_ROLES_CACHE_TTL)
+        roles = user._forum_roles = frozenset(names)
+    return roles
+
+
+def is_moderator(user):
+    return bool(get_roles(user))
+
+
+async def ais_moderator(user):
+    return bool(await aget_roles(user))
+
+
+def invalidate(user_ids):
+    keys = [_cache_key(user_id) for user_id in user_ids]
+    if keys:
+        cache.delete_many(keys)
+
+
+def invalidate_all():
+    try:
+        cache.incr(_GENERATION_KEY)
+    except ValueError:
+        cache.set(_GENERATION_KEY, 1, None)
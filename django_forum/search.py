@@ -0,0 +1,238 @@
+import re
+
+from django.db import connection, connections, router
+from django.urls import reverse
+from django.utils.dateparse import parse_datetime
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+from .models import Topic, Post, Message, Conversation
+
+
+# Полнотекстовый поиск на SQLite FTS5. Виртуальная таблица не является моделью Django:
+# она создается после migrate (см. signals.py) и зеркалирует Topic, Post и Message.
+# rowid = id * 3 + код типа, поэтому обновление и удаление строки — поиск по первичному ключу.
+
+SEARCH_TABLE = 'forum_search'
+
+KIND_TOPIC = 0
+KIND_POST = 1
+KIND_MESSAGE = 2
+
+PUBLIC_SCOPE = 'public'
+
+# Маркеры подсветки: snippet() вставляет их в текст, а после экранирования они заменяются на <mark>
+_HIGHLIGHT_START = '\x02'
+_HIGHLIGHT_END = '\x03'
+
+
+def search_available(using='default'):
+    return connections[using].vendor == 'sqlite'
+
+
+def create_search_table(using='default'):
+    if not search_available(using):
+        return
+    with connections[using].cursor() as cursor:
+        cursor.execute(
+            f'CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5('
+            'title, body, scope, '
+            'kind UNINDEXED, object_id UNINDEXED, topic_id UNINDEXED, conversation_id UNINDEXED, '
+            'created_at UNINDEXED, '
+            "tokenize = 'unicode61 remove_diacritics 2')"
+        )
+
+
+def _rowid(kind, object_id):
+    return object_id * 3 + kind
+
+
+def _user_scope(user_id):
+    return f'u{user_id}'
+
+
+def _topic_row(topic):
+    return (_rowid(KIND_TOPIC, topic.id), topic.title, topic.content, PUBLIC_SCOPE,
+            KIND_TOPIC, topic.id, topic.id, None, topic.created_at)
+
+
+def _post_row(post):
+    return (_rowid(KIND_POST, post.id), '', post.content, PUBLIC_SCOPE,
+            KIND_POST, post.id, post.topic_id, None, post.created_at)
+
+
+def _message_row(message, participant_ids):
+    # Сообщения видны только участникам переписки: их id попадают в индексируемую колонку scope
+    scope = ' '.join(_user_scope(user_id) for user_id in participant_ids)
+    return (_rowid(KIND_MESSAGE, message.id), '', message.content, scope,
+            KIND_MESSAGE, message.id, None, message.conversation_id, message.created_at)
+
+
+def _replace_rows(cursor, rows):
+    cursor.executemany(f'DELETE FROM {SEARCH_TABLE} WHERE rowid = %s', [(row[0],) for row in rows])
+    cursor.executemany(
+        f'INSERT INTO {SEARCH_TABLE} (rowid, title, body, scope, kind, object_id, topic_id, '
+        'conversation_id, created_at) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)',
+        rows,
+    )
+
+
+def index_topic(topic):
+    if search_available():
+        with connection.cursor() as cursor:
+            _replace_rows(cursor, [_topic_row(topic)])
+
+
+def index_post(post):
+    if search_available():
+        with connection.cursor() as cursor:
+            _replace_rows(cursor, [_post_row(post)])
+
+
+def index_message(message):
+    if search_available():
+        participant_ids = list(message.conversation.participants.values_list('id', flat=True))
+        with connection.cursor() as cursor:
+            _replace_rows(cursor, [_message_row(message, participant_ids)])
+
+
+def reindex_conversation(conversation):
+    # Состав участников изменился — обновляем scope у всех сообщений переписки
+    if not search_available():
+        return
+    participant_ids = list(conversation.participants.values_list('id', flat=True))
+    scope = ' '.join(_user_scope(user_id) for user_id in participant_ids)
+    message_ids = conversation.messages.values_list('id', flat=True)
+    with connection.cursor() as cursor:
+        cursor.executemany(f'UPDATE {SEARCH_TABLE} SET scope = %s WHERE rowid = %s',
+                           [(scope, _rowid(KIND_MESSAGE, message_id)) for message_id in message_ids])
+
+
+def remove(kind, object_id):
+    if search_available():
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {SEARCH_TABLE} WHERE rowid = %s', [_rowid(kind, object_id)])
+
+
+def remove_many(kind, object_ids):
+    if search_available():
+        with connection.cursor() as cursor:
+            cursor.executemany(f'DELETE FROM {SEARCH_TABLE} WHERE rowid = %s',
+                               [(_rowid(kind, object_id),) for object_id in object_ids])
+
+
+def _batches(queryset, batch_size):
+    # Обход большой таблицы пачками по первичному ключу (без OFFSET)
+    last_id = 0
+    while True:
+        batch = list(queryset.filter(id__gt=last_id).order_by('id')[:batch_size])
+        if not batch:
+            return
+        yield batch
+        last_id = batch[-1].id
+
+
+def rebuild_index(batch_size=2000, log=None):
+    create_search_table()
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {SEARCH_TABLE}')
+        insert = (f'INSERT INTO {SEARCH_TABLE} (rowid, title, body, scope, kind, object_id, topic_id, '
+                  'conversation_id, created_at) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)')
+
+        total = 0
+        for batch in _batches(Topic.objects.only('id', 'title', 'content', 'created_at'), batch_size):
+            cursor.executemany(insert, [_topic_row(topic) for topic in batch])
+            total += len(batch)
+        if log:
+            log(f'Topics: {total}')
+
+        total = 0
+        for batch in _batches(Post.objects.only('id', 'topic_id', 'content', 'created_at'), batch_size):
+            cursor.executemany(insert, [_post_row(post) for post in batch])
+            total += len(batch)
+        if log:
+            log(f'Posts: {total}')
+
+        total = 0
+        messages = Message.objects.only('id', 'conversation_id', 'content', 'created_at')
+        for batch in _batches(messages, batch_size):
+            participants = {}
+            through = Conversation.participants.through.objects.filter(
+                conversation_id__in={message.conversation_id for message in batch})
+            for conversation_id, user_id in through.values_list('conversation_id', 'user_id'):
+                participants.setdefault(conversation_id, []).append(user_id)
+            cursor.executemany(insert, [_message_row(message, participants.get(message.conversation_id, []))
+                                        for message in batch])
+            total += len(batch)
+        if log:
+            log(f'Messages: {total}')
+
+        # Слияние сегментов индекса после массовой вставки
+        cursor.execute(f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}) VALUES ('optimize')")
+
+
+def build_match_query(text):
+    # Пользовательский ввод превращается в набор фраз в кавычках, чтобы операторы FTS5
+    # (NEAR, OR, двоеточия, скобки) не интерпретировались. Последнее слово ищется по префиксу.
+    terms = re.findall(r'\w+', text)
+    if not terms:
+        return None
+    quoted = ['"%s"' % term.replace('"', '""') for term in terms]
+    quoted[-1] += '*'
+    return ' '.join(quoted)
+
+
+def _highlight(snippet):
+    html = escape(snippet).replace(_HIGHLIGHT_START, '<mark>').replace(_HIGHLIGHT_END, '</mark>')
+    return mark_safe(html)
+
+
+class SearchResult:
+    def __init__(self, kind, object_id, topic_id, conversation_id, created_at, title, snippet):
+        self.kind = kind
+        self.object_id = object_id
+        self.topic_id = topic_id
+        self.conversation_id = conversation_id
+        self.created_at = parse_datetime(created_at) if isinstance(created_at, str) else created_at
+        self.title = _highlight(title)
+        self.snippet = _highlight(snippet)
+
+    @property
+    def kind_name(self):
+        return {KIND_TOPIC: 'topic', KIND_POST: 'post', KIND_MESSAGE: 'message'}[self.kind]
+
+    @property
+    def url(self):
+        if self.kind == KIND_TOPIC:
+            return reverse('topic_detail', args=[self.topic_id])
+        if self.kind == KIND_POST:
+            return reverse('topic_detail', args=[self.topic_id]) + f'?post={self.object_id}#post-{self.object_id}'
+        return reverse('conversation_detail', args=[self.conversation_id])
+
+
+def search(text, user=None, include_messages=True, offset=0, limit=20):
+    """
+    Возвращает (results, has_next). Результаты отсортированы по bm25, заголовок весит больше текста.
+    """
+    match = build_match_query(text)
+    using = router.db_for_read(Topic)  # На реплике, если поиск вызван из view, обслуживаемого репликой
+    if match is None or not search_available(using):
+        return [], False
+
+    scopes = [PUBLIC_SCOPE]
+    if include_messages and user is not None and user.is_authenticated:
+        scopes.append(_user_scope(user.id))
+    match = '{scope}: (%s) AND {title body}: (%s)' % (' OR '.join(scopes), match)
+
+    with connections[using].cursor() as cursor:
+        cursor.execute(
+            f'SELECT kind, object_id, topic_id, conversation_id, created_at, '
+            f"highlight({SEARCH_TABLE}, 0, %s, %s), "
+            f"snippet({SEARCH_TABLE}, 1, %s, %s, '…', 24) "
+            f'FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s '
+            f'ORDER BY bm25({SEARCH_TABLE}, 5.0, 1.0, 0.0) LIMIT %s OFFSET %s',
+            [_HIGHLIGHT_START, _HIGHLIGHT_END, _HIGHLIGHT_START, _HIGHLIGHT_END, match, limit + 1, offset],
+        )
+        rows = cursor.fetchall()
+    results = [SearchResult(*row) for row in rows[:limit]]
+    return results, len(rows) > limit
@@ -12,6 +12,8 @@ https://docs.djangoproject.com/en/5.1/ref/settings/
 
 from pathlib import Path
 
+from .dbconfig import databases_from_env, env_bool
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -41,11 +43,15 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'django_forum.middleware.RequestMetricsMiddleware',
+    'django_forum.middleware.ReplicaRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'django_forum.middleware.BanEnforcementMiddleware',
+    'django_forum.middleware.ActivityMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -54,7 +60,7 @@ ROOT_URLCONF = 'django_forum.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'django_forum.metrics.TimedDjangoTemplates',  # DjangoTemplates с замером времени рендеринга
         'DIRS': [BASE_DIR / 'templates',
                  BASE_DIR / 'templates/forum'],
         'APP_DIRS': True,
@@ -75,11 +81,24 @@ WSGI_APPLICATION = 'django_forum.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
-    }
+# Основная база и реплики задаются переменными окружения (см. dbconfig.py),
+# по умолчанию — локальный SQLite без реплик
+DATABASES = databases_from_env(default_url=f'sqlite:///{BASE_DIR / "db.sqlite3"}')
+DATABASE_ROUTERS = ['django_forum.dbrouter.ReplicaRouter']
+FORUM_REPLICA_DATABASES = [alias for alias in DATABASES if alias != 'default']
+# View, которые только читают и могут обслуживаться репликой
+FORUM_REPLICA_VIEWS = {'section_list', 'subsection_list', 'topic_list', 'forum_stats', 'search'}
+FORUM_REPLICA_PIN_SECONDS = 5  # Сколько секунд после записи пользователь читает из основной базы
+
+# Профиль производительности SQLite (см. sqlite.py); FORUM_SQLITE_TUNING=0 в окружении отключает его
+FORUM_SQLITE_TUNING = env_bool('FORUM_SQLITE_TUNING', True)
+FORUM_SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,  # мс
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -64 * 1024,  # Отрицательное значение — размер в КиБ
+    'temp_store': 'MEMORY',
 }
 
 
@@ -121,6 +140,118 @@ STATIC_URL = 'static/'
 STATICFILES_DIRS = [
     BASE_DIR / "static",
 ]
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'django-forum',
+    }
+}
+
+# Снимок статистики форума (/stats/)
+FORUM_STATS_TTL = 300  # Время жизни снимка в кэше, секунды
+FORUM_STATS_REFRESH_AHEAD = 60  # За сколько секунд до истечения начинать фоновый пересчет
+FORUM_STATS_LOCK_TIMEOUT = 30
+
+# Метрики запросов (см. middleware.py) и бюджеты SQL-запросов на view.
+# В режиме отладки чтение, превысившее бюджет, завершается исключением QueryBudgetExceeded;
+# изменяющий запрос к этому моменту уже закоммичен, и превышение только логируется.
+FORUM_ENFORCE_QUERY_BUDGETS = DEBUG
+FORUM_QUERY_BUDGETS = {
+    'section_list': 5,
+    'subsection_list': 6,
+    'topic_list': 8,
+    'topic_detail': 14,
+    'reply_to_post': 16,
+    'forum_stats': 5,
+    'search': 5,
+    'conversation_list': 6,
+    'conversation_detail': 10,
+    'conversation_messages': 5,
+    'user_profile': 8,
+}
+# Бюджеты изменяющих запросов (POST и т.п.), если они отличаются от бюджета чтения того же view
+FORUM_WRITE_QUERY_BUDGETS = {
+    # Голос за карму: сессия, пользователь, проверка бана, BEGIN, цель голоса,
+    # get_or_create в журнале (2 SAVEPOINT, SELECT, INSERT, 2 RELEASE) и UPDATE кармы
+    'user_profile': 12,
+    # Новый пост при холодном кэше: сессия, пользователь (под WSGI async-view с login_required загружает его
+    # еще раз), проверка бана, BEGIN, топик, INSERT, 4 UPDATE счетчиков, подраздел топика, 2 запроса
+    # поискового индекса и UPDATE пути в дереве. COMMIT через execute-обертки не проходит и не считается.
+    'topic_detail': 15,
+    'reply_to_post': 16,  # +1 родительский пост
+}
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'django_forum.metrics': {'handlers': ['console'], 'level': 'INFO', 'propagate': False},
+    },
+}
+
+# Баны: результат проверки кэшируется на пользователя и сбрасывается при изменении Ban
+FORUM_BAN_CACHE_TTL = 300
+FORUM_BAN_EXEMPT_URLS = {'login', 'logout'}  # Забаненный пользователь все равно может войти и выйти
+
+# Роли (Admin, Moderator) кэшируются на пользователя и сбрасываются при изменении групп
+FORUM_ROLES_CACHE_TTL = 3600
+
+# Голоса за карму: token bucket на пользователя — до 10 голосов подряд, затем 1 голос в минуту
+FORUM_KARMA_VOTE_BURST = 10
+FORUM_KARMA_VOTE_RATE = 1 / 60  # Токенов в секунду
+
+# Админка: для таблиц больше этого размера число строк без фильтров оценивается, а не считается COUNT(*)
+FORUM_ADMIN_EXACT_COUNT_LIMIT = 100000
+FORUM_MASS_BAN_DAYS = 30  # Срок бана для массового действия в админке
+
+# Кэш страниц списков для анонимных посетителей (см. pagecache.py); версии страниц хранятся без срока
+FORUM_PAGE_CACHE_TIMEOUT = 600
+
+# Просмотры топиков копятся в памяти процесса и сбрасываются пачкой (см. viewcounts.py)
+FORUM_VIEW_FLUSH_INTERVAL = 10  # Секунд между сбросами
+FORUM_VIEW_FLUSH_HITS = 500  # Или после стольких просмотров
+FORUM_VIEW_FLUSH_BATCH = 500  # Топиков в одном UPDATE
+FORUM_VIEW_DEDUPE_SECONDS = 30 * 60  # Повторный просмотр в той же сессии не считается
+
+# Активность пользователей (см. activity.py): время последнего запроса пишется в базу
+# не чаще раза в FORUM_ACTIVITY_PERSIST_INTERVAL секунд на пользователя
+FORUM_ACTIVITY_PERSIST_INTERVAL = 60
+FORUM_ACTIVITY_FLUSH_BATCH = 500  # Пользователей в одном UPDATE
+FORUM_ONLINE_WINDOW = 5 * 60  # Кто заходил за это время, считается онлайн
+FORUM_ONLINE_LIMIT = 100
+FORUM_ONLINE_CACHE_TTL = 30
+
+# Профиль пользователя: сколько последних банов и варнов показывать
+FORUM_PROFILE_HISTORY_LIMIT = 20
+
+# Доставка сообщений QMS в реальном времени (WebSocket в asgi.py и long-poll)
+FORUM_PUBSUB_HUB = 'django_forum.pubsub.InProcessHub'  # 'django_forum.pubsub.CacheHub' для нескольких воркеров
+FORUM_PUBSUB_CACHE = 'default'  # Кэш для CacheHub, должен быть общим для воркеров
+FORUM_PUBSUB_POLL_INTERVAL = 0.5
+FORUM_QMS_WAIT_TIMEOUT = 25  # Сколько секунд long-poll ждет новое сообщение
+FORUM_QMS_BATCH_SIZE = 100  # Максимум сообщений в одном ответе
+FORUM_QMS_WINDOW = 50  # Сколько последних сообщений показывать при открытии переписки
+FORUM_CONVERSATIONS_PER_PAGE = 30
+
+# Постраничный вывод топиков в подразделе
+FORUM_TOPICS_PER_PAGE = 30
+
+# Постраничный вывод постов в топике
+FORUM_POSTS_PER_PAGE = 50
+FORUM_MAX_POSTS_PER_PAGE = 200
+FORUM_STREAM_MAX_POSTS = 5000  # Предел для потоковой отдачи (?stream=1)
+FORUM_STREAM_CHUNK_SIZE = 500
+
+# Полнотекстовый поиск (/search/)
+FORUM_SEARCH_RESULTS_PER_PAGE = 20
+FORUM_SEARCH_MAX_PAGES = 50
+
 YOUR_ENCRYPTION_KEY = b'YG_9o1NJ2VvU7pQhmxMifPGSiXpmHy82_0Lpn26PXf4='
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
@@ -0,0 +1,170 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.contrib.auth.models import Group, User
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_save, post_delete, post_migrate, m2m_changed
+from django.dispatch import receiver
+
+from . import bans, counters, pagecache, roles, search, sqlite
+from .metrics import install_query_recorder
+from .models import Section, Subsection, Topic, Post, Conversation, Message, Ban, Warn
+from .pubsub import conversation_channel, get_hub
+
+
+# Массовые операции (moderation.py) отключают поштучное обновление счетчиков и индекса
+# и пересчитывают их сами одним набором запросов
+_suspended = ContextVar('forum_signals_suspended', default=False)
+
+
+@contextmanager
+def suspended():
+    token = _suspended.set(True)
+    try:
+        yield
+    finally:
+        _suspended.reset(token)
+
+
+# Счетчики тем и постов, поисковый индекс
+@receiver(post_save, sender=Topic)
+def topic_saved(sender, instance, created, raw=False, **kwargs):
+    if raw or _suspended.get():
+        return
+    if created:
+        counters.topic_created(instance)
+    search.index_topic(instance)
+    pagecache.bump_subsections([instance.subsection_id])
+
+
+@receiver(post_delete, sender=Topic)
+def topic_deleted(sender, instance, **kwargs):
+    if _suspended.get():
+        return
+    counters.topic_deleted(instance)
+    search.remove(search.KIND_TOPIC, instance.id)
+    pagecache.bump_subsections([instance.subsection_id])
+
+
+@receiver(post_save, sender=Post)
+def post_saved(sender, instance, created, raw=False, **kwargs):
+    if raw or _suspended.get():
+        return
+    if created:
+        counters.post_created(instance)
+        pagecache.bump_topic(instance.topic_id, _cached_subsection_id(instance))
+    search.index_post(instance)
+
+
+@receiver(post_delete, sender=Post)
+def post_deleted(sender, instance, **kwargs):
+    if _suspended.get():
+        return
+    counters.post_deleted(instance)
+    search.remove(search.KIND_POST, instance.id)
+    pagecache.bump_topic(instance.topic_id, _cached_subsection_id(instance))
+
+
+# Версии страниц списков для кэша анонимных страниц (pagecache.py)
+@receiver(post_save, sender=Section)
+@receiver(post_delete, sender=Section)
+def section_changed(sender, instance, raw=False, **kwargs):
+    if not raw:
+        pagecache.bump_section(instance.id)
+
+
+@receiver(post_save, sender=Subsection)
+@receiver(post_delete, sender=Subsection)
+def subsection_changed(sender, instance, raw=False, **kwargs):
+    if not raw:
+        pagecache.forget_subsection(instance.id)
+        pagecache.bump_section(instance.section_id)
+
+
+def _cached_subsection_id(post):
+    # View обычно уже загрузил топик поста — тогда подраздел известен без запроса
+    return post.topic.subsection_id if Post.topic.is_cached(post) else None
+
+
+@receiver(post_save, sender=Message)
+def message_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    search.index_message(instance)
+    if created:
+        counters.message_created(instance)
+        # Подписчики переписки узнают о сообщении только после коммита, когда его уже можно прочитать
+        channel = conversation_channel(instance.conversation_id)
+        transaction.on_commit(lambda: get_hub().publish(channel, instance.id))
+
+
+@receiver(post_delete, sender=Message)
+def message_deleted(sender, instance, **kwargs):
+    counters.message_deleted(instance)
+    search.remove(search.KIND_MESSAGE, instance.id)
+
+
+@receiver(m2m_changed, sender=Conversation.participants.through)
+def conversation_participants_changed(sender, instance, action, reverse, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear') and not reverse:
+        search.reindex_conversation(instance)
+
+
+# Кэш проверки банов и агрегаты профиля
+@receiver(post_save, sender=Ban)
+@receiver(post_delete, sender=Ban)
+def ban_changed(sender, instance, raw=False, **kwargs):
+    # Кэш сбрасывается после коммита: иначе параллельный запрос успел бы снова закэшировать «не забанен»
+    user_id = instance.user_id
+    transaction.on_commit(lambda: bans.invalidate(user_id))
+    if not raw:
+        counters.bans_changed([user_id])
+
+
+@receiver(post_save, sender=Warn)
+def warn_saved(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        counters.warn_created(instance)
+
+
+@receiver(post_delete, sender=Warn)
+def warn_deleted(sender, instance, **kwargs):
+    counters.warn_deleted(instance)
+
+
+# Кэш ролей: членство в группах изменилось
+@receiver(m2m_changed, sender=User.groups.through)
+def user_groups_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    # Как и для банов, кэш сбрасывается после коммита, чтобы в него не вернулись старые роли
+    if not reverse:
+        user_ids = [instance.pk]
+        transaction.on_commit(lambda: roles.invalidate(user_ids))
+    elif pk_set:
+        user_ids = set(pk_set)
+        transaction.on_commit(lambda: roles.invalidate(user_ids))
+    else:
+        # group.user_set.clear() не передает id пользователей
+        transaction.on_commit(roles.invalidate_all)
+
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def group_changed(sender, instance, **kwargs):
+    transaction.on_commit(roles.invalidate_all)
+
+
+# Виртуальная таблица FTS5 не описывается моделью, поэтому создается после migrate
+@receiver(post_migrate)
+def create_search_table(sender, using='default', **kwargs):
+    if sender.name == 'django_forum':
+        search.create_search_table(using)
+
+
+# Учет SQL-запросов для метрик (см. middleware.py)
+@receiver(connection_created)
+def connection_opened(sender, connection, **kwargs):
+    sqlite.apply_pragmas(connection)
+    install_query_recorder(connection)
@@ -0,0 +1,20 @@
+from django.conf import settings
+
+
+# Профиль производительности SQLite. PRAGMA применяются к каждому новому соединению
+# (signals.py, connection_created):
+#   journal_mode=WAL      читатели не блокируют писателя и наоборот
+#   synchronous=NORMAL    в режиме WAL fsync только при checkpoint, без риска повредить базу
+#   busy_timeout          ждать освобождения блокировки вместо немедленного «database is locked»
+#   mmap_size, cache_size чтение страниц через отображение файла и больший кэш страниц
+#   temp_store=MEMORY     временные таблицы и индексы сортировки в памяти
+# Транзакции записи открываются как BEGIN IMMEDIATE (OPTIONS transaction_mode, см. dbconfig.py):
+# блокировка на запись берется сразу, и ожидание busy_timeout работает, а не обрывается
+# ошибкой при попытке повысить блокировку чтения до записи.
+
+def apply_pragmas(connection):
+    if connection.vendor != 'sqlite' or not settings.FORUM_SQLITE_TUNING:
+        return
+    with connection.cursor() as cursor:
+        for name, value in settings.FORUM_SQLITE_PRAGMAS.items():
+            cursor.execute(f'PRAGMA {name} = {value}')
@@ -0,0 +1,124 @@
+import asyncio
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.utils import timezone
+
+from .models import Section, Subsection
+
+logger = logging.getLogger(__name__)
+
+STATS_KEY = 'forum:stats'
+STATS_LOCK_KEY = 'forum:stats:lock'
+COLD_START_POLL = 0.05  # Как часто ждущие холодного старта проверяют, не появился ли снимок, секунды
+
+
+# Снимок статистики форума хранится в кэше целиком. Незадолго до истечения TTL
+# один воркер (тот, кто взял блокировку через cache.add) пересчитывает его в фоне,
+# остальные в это время отдают старый снимок — без лавины одинаковых запросов.
+# На холодном старте снимок строит тоже только владелец блокировки, остальные ждут его.
+
+def _sections():
+    return Section.objects.values('name', 'topic_count', 'post_count')
+
+
+def _subsections():
+    return Subsection.objects.values('name', 'topic_count', 'post_count')
+
+
+def compute_stats():
+    return _summarize(list(_sections()), list(_subsections()))
+
+
+async def acompute_stats():
+    return _summarize([row async for row in _sections()], [row async for row in _subsections()])
+
+
+def _summarize(sections, subsections):
+    return {
+        'section_count': len(sections),
+        'subsection_count': len(subsections),
+        'topic_count': sum(section['topic_count'] for section in sections),
+        'post_count': sum(section['post_count'] for section in sections),
+        'topics_by_section': sections,
+        'topics_by_subsection': subsections,
+    }
+
+
+def _store_snapshot():
+    snapshot = {'stats': compute_stats(), 'computed_at': timezone.now()}
+    cache.set(STATS_KEY, snapshot, settings.FORUM_STATS_TTL)
+    return snapshot
+
+
+async def _astore_snapshot():
+    snapshot = {'stats': await acompute_stats(), 'computed_at': timezone.now()}
+    await cache.aset(STATS_KEY, snapshot, settings.FORUM_STATS_TTL)
+    return snapshot
+
+
+def _refresh_in_background():
+    try:
+        _store_snapshot()
+    except Exception:
+        logger.exception('Forum stats refresh failed')
+    finally:
+        cache.delete(STATS_LOCK_KEY)
+        connection.close()  # У фонового потока свое соединение с БД
+
+
+def _needs_refresh(snapshot):
+    age = (timezone.now() - snapshot['computed_at']).total_seconds()
+    return age >= settings.FORUM_STATS_TTL - settings.FORUM_STATS_REFRESH_AHEAD
+
+
+def _cold_snapshot():
+    # Если владелец блокировки упал, не сняв ее, блокировка истечет через FORUM_STATS_LOCK_TIMEOUT
+    while True:
+        if cache.add(STATS_LOCK_KEY, True, settings.FORUM_STATS_LOCK_TIMEOUT):
+            try:
+                return _store_snapshot()
+            finally:
+                cache.delete(STATS_LOCK_KEY)
+        time.sleep(COLD_START_POLL)
+        snapshot = cache.get(STATS_KEY)
+        if snapshot is not None:
+            return snapshot
+
+
+async def _acold_snapshot():
+    while True:
+        if await cache.aadd(STATS_LOCK_KEY, True, settings.FORUM_STATS_LOCK_TIMEOUT):
+            try:
+                return await _astore_snapshot()
+            finally:
+                await cache.adelete(STATS_LOCK_KEY)
+        await asyncio.sleep(COLD_START_POLL)
+        snapshot = await cache.aget(STATS_KEY)
+        if snapshot is not None:
+            return snapshot
+
+
+def get_stats_snapshot():
+    snapshot = cache.get(STATS_KEY)
+    if snapshot is None:
+        return _cold_snapshot()
+
+    if _needs_refresh(snapshot) and cache.add(STATS_LOCK_KEY, True, settings.FORUM_STATS_LOCK_TIMEOUT):
+        threading.Thread(target=_refresh_in_background, daemon=True).start()
+    return snapshot
+
+
+async def aget_stats_snapshot():
+    snapshot = await cache.aget(STATS_KEY)
+    if snapshot is None:
+        return await _acold_snapshot()
+
+    # Фоновый пересчет — тот же поток, что и для синхронного view
+    if _needs_refresh(snapshot) and await cache.aadd(STATS_LOCK_KEY, True, settings.FORUM_STATS_LOCK_TIMEOUT):
+        threading.Thread(target=_refresh_in_background, daemon=True).start()
+    return snapshot
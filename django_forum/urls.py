@@ -24,8 +24,14 @@ urlpatterns = [
     path('user/<int:user_id>/warn/', views.warn_user, name='warn_user'),
     path('user/<int:user_id>/ban/', views.ban_user, name='ban_user'),
     path('stats/', views.forum_stats, name='forum_stats'),
+    path('search/', views.search, name='search'),
+    path('metrics/', views.metrics, name='metrics'),
     path('qms/', views.conversation_list, name='conversation_list'),
     path('qms/conversation/<int:conversation_id>/', views.conversation_detail, name='conversation_detail'),
+    path('qms/conversation/<int:conversation_id>/poll/', views.conversation_poll, name='conversation_poll'),
+    path('qms/conversation/<int:conversation_id>/messages/', views.conversation_messages,
+         name='conversation_messages'),
+    # qms/conversation/<id>/ws/ обслуживается WebSocket-приложением в asgi.py
     path('qms/start/<int:user_id>/', views.start_conversation, name='start_conversation'),
     path('user/<int:user_id>/ban/', views.ban_user, name='ban_user'),
 ]
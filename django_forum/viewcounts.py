@@ -0,0 +1,100 @@
+import atexit
+import logging
+import threading
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Value, When
+
+from .metrics import unmetered
+from .models import Topic
+
+logger = logging.getLogger(__name__)
+
+
+# Счетчик просмотров топиков. Просмотр не пишет в базу: приращения копятся в памяти процесса
+# и сбрасываются одним UPDATE раз в FORUM_VIEW_FLUSH_INTERVAL секунд или каждые
+# FORUM_VIEW_FLUSH_HITS просмотров. Повторный просмотр того же топика в той же сессии
+# в течение FORUM_VIEW_DEDUPE_SECONDS не считается.
+
+class ViewCounter:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._hits = 0
+        self._last_flush = time.monotonic()
+
+    def add(self, topic_id):
+        # Возвращает True, когда пора сбрасывать накопленное в базу
+        with self._lock:
+            self._pending[topic_id] = self._pending.get(topic_id, 0) + 1
+            self._hits += 1
+            return (self._hits >= settings.FORUM_VIEW_FLUSH_HITS
+                    or time.monotonic() - self._last_flush >= settings.FORUM_VIEW_FLUSH_INTERVAL)
+
+    def record(self, topic_id):
+        if self.add(topic_id):
+            self.flush()
+
+    def pending(self, topic_id):
+        return self._pending.get(topic_id, 0)
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._hits = 0
+            self._last_flush = time.monotonic()
+        if not pending:
+            return 0
+        try:
+            # Отдельная транзакция (или savepoint): ошибка не испортит транзакцию запроса
+            with unmetered(), transaction.atomic():
+                self._write(pending)
+        except Exception:
+            # База недоступна или заблокирована — возвращаем приращения, они уйдут со следующим сбросом
+            with self._lock:
+                for topic_id, count in pending.items():
+                    self._pending[topic_id] = self._pending.get(topic_id, 0) + count
+            # Сброс выполняется внутри чужого запроса: ошибка базы не должна ронять страницу
+            logger.exception('Topic view count flush failed, %d topics kept for the next flush', len(pending))
+            return 0
+        return len(pending)
+
+    def _write(self, pending):
+        items = list(pending.items())
+        for start in range(0, len(items), settings.FORUM_VIEW_FLUSH_BATCH):
+            batch = items[start:start + settings.FORUM_VIEW_FLUSH_BATCH]
+            increment = Case(*[When(pk=topic_id, then=Value(count)) for topic_id, count in batch],
+                             default=Value(0), output_field=IntegerField())
+            Topic.objects.filter(pk__in=[topic_id for topic_id, _ in batch]).update(
+                view_count=F('view_count') + increment)
+
+
+counter = ViewCounter()
+atexit.register(counter.flush)
+
+
+def _viewed_key(request, topic_id):
+    # У анонима без сессии ключа нет — считаем по адресу
+    session_key = request.session.session_key or request.META.get('REMOTE_ADDR', '')
+    return f'forum:viewed:{session_key}:{topic_id}'
+
+
+def record_view(request, topic_id):
+    # Дедупликация по сессии через кэш: cache.add атомарен и не трогает саму сессию (не пишет в базу)
+    if cache.add(_viewed_key(request, topic_id), 1, settings.FORUM_VIEW_DEDUPE_SECONDS):
+        counter.record(topic_id)
+
+
+async def arecord_view(request, topic_id):
+    if await cache.aadd(_viewed_key(request, topic_id), 1, settings.FORUM_VIEW_DEDUPE_SECONDS):
+        if counter.add(topic_id):
+            await sync_to_async(counter.flush)()
+
+
+def approximate_views(topic):
+    # Сохраненное значение плюс еще не сброшенные просмотры этого процесса
+    return topic.view_count + counter.pending(topic.id)
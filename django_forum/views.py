@@ -1,3 +1,6 @@
+from functools import wraps
+
+from asgiref.sync import sync_to_async
 from cryptography import fernet
 from cryptography.fernet import InvalidToken
 from django.db.models import Count
@@ -7,17 +10,36 @@ from django.contrib.auth.models import User
 from django.db.models.signals import post_save
 from django.dispatch import receiver
 from django.http import HttpResponseNotFound
-from django.shortcuts import render, get_object_or_404, redirect
+from django.shortcuts import render, get_object_or_404, aget_object_or_404, redirect
 from django.contrib.auth.decorators import login_required, user_passes_test
 from django.contrib.auth import update_session_auth_hash
 from django.contrib.auth import login
 from django.contrib.auth.forms import AuthenticationForm
 from django.contrib.auth.views import LoginView
 from .forms import CustomUserCreationForm
-from .models import Section, Subsection, Topic, Post, UserProfile, Warn, Ban
+from .models import Section, Subsection, Topic, Post, UserProfile, Warn, Ban, KarmaVote
 from django.contrib import messages
 from .forms import *
-from django.http import HttpResponse
+from django.http import HttpResponse, StreamingHttpResponse, Http404
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.db import transaction
+from django.db.models import Prefetch
+from django.template.loader import get_template, render_to_string
+from django.utils.safestring import mark_safe
+from .pagination import InvalidCursor, akeyset_paginate, encode_cursor, keyset_paginate, keyset_stream
+from .readstate import (aget_topic_read_state, amark_topic_read, get_topic_read_state, mark_topic_read,
+                        mark_conversation_read, annotate_topic_unread, annotate_conversation_unread)
+from .stats import aget_stats_snapshot
+from .pagecache import cache_anonymous_page
+from . import activity, karma, roles, search as forum_search, viewcounts
+from .metrics import registry as metrics_registry
+from .middleware import aresolve_user
+from .pubsub import conversation_channel, get_hub
+from .qms import afetch_messages_after, ais_participant, fetch_messages, is_participant, serialize_message
+from django.http import JsonResponse
+
+STREAM_MARKER = mark_safe('<!-- forum:posts -->')
 
 def register(request):
     if request.method == 'POST':
@@ -40,48 +62,169 @@ def admin_check(user):
     return user.is_superuser
 
 
+# Роли берутся из кэша (roles.py), без запроса к группам на каждой странице
 def is_moderator(user):
-    return user.groups.filter(name__in=['Admin', 'Moderator']).exists()
+    return roles.is_moderator(user)
 
 
-# Главная страница, отображающая список разделов
-def section_list(request):
-    sections = Section.objects.all()
-    return render(request, 'forum/section_list.html', {'sections': sections})
+async def ais_moderator(user):
+    return await roles.ais_moderator(user)
 
 
-def subsection_list(request, section_id):
-    section = get_object_or_404(Section, id=section_id)
+# Изменяющий запрос выполняется одной транзакцией; в SQLite она открывается как BEGIN IMMEDIATE
+# (см. sqlite.py), поэтому параллельные посты ждут блокировку, а не получают «database is locked»
+def atomic_on_write(view):
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if request.method in ('GET', 'HEAD'):
+            return view(request, *args, **kwargs)
+        with transaction.atomic():
+            return view(request, *args, **kwargs)
+    return wrapper
 
-    # Получаем все подразделы текущего раздела
-    subsections = section.subsections.all()
 
-    # Для каждой секции аннотируем количество тем
-    for subsection in subsections:
-        subsection.num_topics = subsection.topics.count()  # Прямо вычисляем количество тем
+# Страницы чтения — async view: под ASGI они не занимают поток на все время запроса, а ходят
+# в базу через async ORM. Пользователь берется через aresolve_user (middleware.py), чтобы шаблон
+# (контекстный процессор auth) не загружал его повторно синхронным запросом.
 
-    context = {
-        'section': section,
-        'subsections': subsections,
+# Главная страница, отображающая список разделов
+@cache_anonymous_page('forum')
+async def section_list(request):
+    await aresolve_user(request)
+    sections = [section async for section in Section.objects.all()]
+    return render(request, 'forum/section_list.html', {'sections': sections})
+
+
+# Страница для просмотра конкретного топика
+POST_ORDERING = ('created_at', 'id')
+POST_TREE_ORDERING = ('path', 'id')  # Древовидный вывод: порядок обхода дерева ответов
+
+
+def _posts_per_page(request):
+    try:
+        per_page = int(request.GET.get('per_page', settings.FORUM_POSTS_PER_PAGE))
+    except ValueError:
+        per_page = settings.FORUM_POSTS_PER_PAGE
+    limit = settings.FORUM_STREAM_MAX_POSTS if request.GET.get('stream') else settings.FORUM_MAX_POSTS_PER_PAGE
+    return max(1, min(per_page, limit))
+
+
+def _stream_topic_page(request, context):
+    # Шапка и подвал страницы рендерятся одним шаблоном, а посты между ними
+    # отдаются по мере чтения курсора базы — память не растет с размером страницы
+    context['stream_marker'] = STREAM_MARKER
+    head, tail = render_to_string('forum/topic_detail.html', context, request).split(STREAM_MARKER)
+    post_template = get_template('forum/post_item.html')
+    posts = context['posts'].items
+    chunk_size = settings.FORUM_STREAM_CHUNK_SIZE
+
+    def render_post(post):
+        return post_template.render({'post': post, 'topic': context['topic'], 'threaded': context['threaded'],
+                                     'read_state': context['read_state']}, request)
+
+    def chunks():
+        yield head
+        for post in posts.iterator(chunk_size=chunk_size):
+            yield render_post(post)
+        yield tail
+
+    # ASGI-обработчик целиком вычитывает sync-итератор до отправки, поэтому под ASGI
+    # отдаем async-итератор: посты читаются из базы пачками по мере отправки
+    async def achunks():
+        yield head
+        async for post in posts.aiterator(chunk_size=chunk_size):
+            yield render_post(post)
+        yield tail
+
+    content = achunks() if isinstance(request, ASGIRequest) else chunks()
+    return StreamingHttpResponse(content, content_type='text/html; charset=utf-8')
+
+
+def _topic_page_options(request):
+    # Параметры страницы топика из GET, общие для sync и async вариантов
+    threaded = request.GET.get('view') == 'threaded'
+    anchor_post_id = request.GET.get('post')
+    thread_root_id = request.GET.get('thread')
+    return {
+        'per_page': _posts_per_page(request),
+        'after': request.GET.get('after'),
+        'before': request.GET.get('before'),
+        'last': bool(request.GET.get('last')),
+        # Древовидный режим: сортировка по материализованному пути, ветка — диапазон путей
+        'threaded': threaded,
+        'ordering': POST_TREE_ORDERING if threaded else POST_ORDERING,
+        'thread_root_id': thread_root_id if threaded and thread_root_id and thread_root_id.isdigit() else None,
+        'anchor_post_id': anchor_post_id if anchor_post_id and anchor_post_id.isdigit() else None,
     }
 
-    return render(request, 'forum/subsection_list.html', context)
-# Страница с топиками в конкретном подразделе
-def topic_list(request, subsection_id):
-    subsection = get_object_or_404(Subsection, id=subsection_id)
-    topics = subsection.topics.all()
-    return render(request, 'forum/topic_list.html', {'subsection': subsection, 'topics': topics})
+
+def _first_unread_cursor(read_state, threaded):
+    # Маркер прочтения — позиция в плоском порядке (created_at, id). Страница древовидного режима
+    # идет в порядке путей: ни курсор, ни «самый новый пост страницы» к ней неприменимы.
+    if read_state is None or threaded:
+        return None
+    return encode_cursor([read_state.last_read_at, read_state.last_read_post_id])
 
 
-# Страница для просмотра конкретного топика
 @login_required
-def topic_detail(request, topic_id, parent_post_id=None):
-    topic = get_object_or_404(Topic, id=topic_id)
-    posts = topic.posts.all()
+async def topic_detail(request, topic_id, parent_post_id=None):
+    # Запись (транзакция) и потоковая выдача (итератор курсора) остаются синхронными
+    user = await aresolve_user(request)
+    if request.method not in ('GET', 'HEAD') or request.GET.get('stream'):
+        return await sync_to_async(_topic_detail)(request, topic_id, parent_post_id)
 
+    topic = await aget_object_or_404(Topic.objects.select_related('author'), id=topic_id)
     parent_post = None
     if parent_post_id:
-        parent_post = get_object_or_404(Post, id=parent_post_id)
+        parent_post = await aget_object_or_404(Post.objects.select_related('author'), id=parent_post_id,
+                                               topic=topic)
+
+    options = _topic_page_options(request)
+    ordering = options['ordering']
+    posts = topic.posts.select_related('author', 'parent_post__author')
+    pager_query = 'view=threaded&' if options['threaded'] else ''
+    if options['thread_root_id']:
+        thread_root = await aget_object_or_404(Post, id=options['thread_root_id'], topic=topic)
+        posts = thread_root.subtree().select_related('author', 'parent_post__author')
+        pager_query += f'thread={thread_root.id}&'
+
+    start = None
+    if options['anchor_post_id']:
+        start = await topic.posts.filter(id=options['anchor_post_id']).values_list(*ordering).afirst()
+
+    try:
+        page = await akeyset_paginate(posts, ordering, options['per_page'], after=options['after'],
+                                      before=options['before'], start=start, last=options['last'])
+    except InvalidCursor:
+        raise Http404('Invalid page cursor')
+
+    await viewcounts.arecord_view(request, topic.id)
+
+    read_state = await aget_topic_read_state(user, topic)
+    first_unread_cursor = _first_unread_cursor(read_state, options['threaded'])
+    if page.items and not options['threaded']:
+        newest = max(page.items, key=lambda post: (post.created_at, post.id))
+        await amark_topic_read(user, topic, newest, read_state)
+
+    return render(request, 'forum/topic_detail.html', {
+        'topic': topic,
+        'posts': page,
+        'read_state': read_state,
+        'first_unread_cursor': first_unread_cursor,
+        'threaded': options['threaded'],
+        'pager_query': pager_query,
+        'post_form': PostForm(),
+        'parent_post': parent_post,
+    })
+
+
+@atomic_on_write
+def _topic_detail(request, topic_id, parent_post_id=None):
+    topic = get_object_or_404(Topic.objects.select_related('author'), id=topic_id)
+
+    parent_post = None
+    if parent_post_id:
+        parent_post = get_object_or_404(Post.objects.select_related('author'), id=parent_post_id, topic=topic)
 
     if request.method == 'POST':
         post_form = PostForm(request.POST)
@@ -91,19 +234,62 @@ def topic_detail(request, topic_id, parent_post_id=None):
             post.author = request.user
             post.parent_post = parent_post  # Устанавливаем, что это ответ на родительский пост, если он есть
             post.save()
-            return redirect('topic_detail', topic_id=topic.id)
+            return redirect(post.get_absolute_url())
     else:
         post_form = PostForm()
 
-    return render(request, 'forum/topic_detail.html', {
+    # Автор, родительский пост и его автор подтягиваются одним JOIN, без запроса на каждый пост
+    options = _topic_page_options(request)
+    ordering = options['ordering']
+    threaded = options['threaded']
+    posts = topic.posts.select_related('author', 'parent_post__author')
+    pager_query = 'view=threaded&' if threaded else ''
+    if options['thread_root_id']:
+        thread_root = get_object_or_404(Post, id=options['thread_root_id'], topic=topic)
+        posts = thread_root.subtree().select_related('author', 'parent_post__author')
+        pager_query += f'thread={thread_root.id}&'
+
+    start = None
+    if options['anchor_post_id']:
+        start = topic.posts.filter(id=options['anchor_post_id']).values_list(*ordering).first()
+
+    stream = bool(request.GET.get('stream')) and request.method == 'GET' and options['before'] is None
+    try:
+        if stream:
+            page = keyset_stream(posts, ordering, options['per_page'], after=options['after'], start=start)
+        else:
+            page = keyset_paginate(posts, ordering, options['per_page'], after=options['after'],
+                                   before=options['before'], start=start, last=options['last'])
+    except InvalidCursor:
+        raise Http404('Invalid page cursor')
+
+    if request.method == 'GET':
+        viewcounts.record_view(request, topic.id)
+
+    # Отметка о прочтении: сдвигаем маркер до самого нового поста на странице (только в плоском режиме)
+    read_state = get_topic_read_state(request.user, topic)
+    first_unread_cursor = _first_unread_cursor(read_state, threaded)
+    if request.method == 'GET' and not stream and page.items and not threaded:
+        newest = max(page.items, key=lambda post: (post.created_at, post.id))
+        mark_topic_read(request.user, topic, newest, read_state)
+
+    context = {
         'topic': topic,
-        'posts': posts,
+        'posts': page,
+        'read_state': read_state,
+        'first_unread_cursor': first_unread_cursor,
+        'threaded': threaded,
+        'pager_query': pager_query,
         'post_form': post_form,
         'parent_post': parent_post  # Передаем родительский пост в шаблон (если есть)
-    })
+    }
+    if stream:
+        return _stream_topic_page(request, context)
+    return render(request, 'forum/topic_detail.html', context)
 
 
 @login_required
+@atomic_on_write
 def create_topic(request, subsection_id):
     subsection = get_object_or_404(Subsection, id=subsection_id)  # Получаем субсекцию по ID
 
@@ -121,6 +307,7 @@ def create_topic(request, subsection_id):
     return render(request, 'forum/create_topic.html', {'form': form, 'subsection': subsection})
 
 @login_required
+@atomic_on_write
 def edit_topic(request, topic_id):
     topic = get_object_or_404(Topic, id=topic_id)
 
@@ -132,7 +319,8 @@ def edit_topic(request, topic_id):
         if form.is_valid():
             topic = form.save(commit=False)
             topic.edited_at = timezone.now()
-            topic.save()
+            # Сохраняем только редактируемые поля, чтобы не затереть счетчики, обновленные сигналами
+            topic.save(update_fields=['title', 'content', 'edited_at'])
             return redirect('topic_detail', topic_id=topic.id)
     else:
         form = TopicEditForm(instance=topic)
@@ -142,38 +330,64 @@ def edit_topic(request, topic_id):
 
 # Добавление нового поста в топик (только для авторизованных пользователей)
 @login_required
+@atomic_on_write
 def add_post(request, topic_id):
     topic = get_object_or_404(Topic, id=topic_id)
     if request.method == 'POST':
         content = request.POST.get('content')
-        Post.objects.create(topic=topic, content=content, author=request.user)
-        return redirect('topic_detail', topic_id=topic.id)
+        post = Post.objects.create(topic=topic, content=content, author=request.user)
+        return redirect(post.get_absolute_url())
     return render(request, 'forum/add_post.html', {'topic': topic})
 
 
 @login_required
+@atomic_on_write
 def user_profile(request, user_id):
-    user_profile = get_object_or_404(UserProfile, user__id=user_id)
-    warnings = Warn.objects.filter(user=user_profile.user)
+    # Голос за карму: запись в журнал KarmaVote и атомарное изменение счетчика (см. karma.py).
+    # Профиль, история и роли для голоса не нужны — загружается только сам пользователь.
+    if request.method == 'POST':
+        target = get_object_or_404(User, pk=user_id)
+        value = {'increase': 1, 'decrease': -1}.get(request.POST.get('action'))
+        if value is None:
+            return HttpResponse('Unknown action', status=400)
+        try:
+            karma.vote(request.user, target, value)
+        except karma.SelfVote:
+            return HttpResponse('You cannot vote for yourself', status=403)
+        except karma.VoteRateLimited:
+            return HttpResponse('Too many votes, try again later', status=429)
+        return redirect('user_profile', user_id=target.id)
+
+    # Счетчики и активный бан хранятся в профиле (см. counters.py), поэтому число запросов
+    # не зависит от истории пользователя; модераторы банов и варнов подгружаются тем же запросом
+    user_profile = get_object_or_404(UserProfile.objects.select_related('user', 'active_ban__moderator'),
+                                     user__id=user_id)
+    history_limit = settings.FORUM_PROFILE_HISTORY_LIMIT
+    bans = (Ban.objects.filter(user=user_profile.user).select_related('moderator')
+            .order_by('-start_date', '-id')[:history_limit])
+    warnings = (Warn.objects.filter(user=user_profile.user).select_related('moderator')
+                .order_by('-created_at', '-id')[:history_limit])
+    active_ban = user_profile.active_ban
+    if active_ban is not None and active_ban.end_date <= timezone.now():
+        active_ban = None  # Истек, но expire_bans еще не выполнялась
 
     # Проверяем, является ли текущий пользователь администратором или модератором
-    is_moderator_or_admin = request.user.groups.filter(name__in=['Admin', 'Moderator']).exists()
+    is_moderator_or_admin = is_moderator(request.user)
 
-    # Логика изменения кармы
-    if request.method == 'POST':
-        action = request.POST.get('action')
-        if action == 'increase':
-            user_profile.karma += 1
-        elif action == 'decrease':
-            user_profile.karma -= 1
-        user_profile.save()
-        return redirect('user_profile', user_id=user_profile.user.id)
+    my_vote = None
+    if request.user != user_profile.user:
+        my_vote = (KarmaVote.objects.filter(voter=request.user, target=user_profile.user)
+                   .values_list('value', flat=True).first())
 
     return render(request, 'forum/user_profile.html', {
         # Проверяем, является ли текущий пользователь администратором или модератором
         'user_profile': user_profile,
+        'bans': bans,
         'warnings': warnings,
+        'active_ban': active_ban,
         'is_moderator_or_admin': is_moderator_or_admin,  # Добавляем переменную в контекст
+        'my_vote': my_vote,
+        'last_seen': activity.last_seen(user_profile),
     })
 
 
@@ -185,11 +399,6 @@ def create_user_profile(sender, instance, created, **kwargs):
         UserProfile.objects.create(user=instance)
 
 
-@receiver(post_save, sender=User)
-def save_user_profile(sender, instance, **kwargs):
-    instance.userprofile.save()
-
-
 # Создание раздела
 @user_passes_test(admin_check)
 def create_section(request):
@@ -216,25 +425,50 @@ def create_subsection(request):
     return render(request, 'forum/create_subsection.html', {'form': form})
 
 
-def subsection_list(request, section_id):
-    section = Section.objects.get(id=section_id)
-    is_moderator_or_admin = request.user.groups.filter(name__in=['Admin', 'Moderator']).exists()
-    subsections = Subsection.objects.filter(section=section)
+@cache_anonymous_page('section', 'section_id')
+async def subsection_list(request, section_id):
+    user = await aresolve_user(request)
+    section = await Section.objects.aget(id=section_id)
+    is_moderator_or_admin = await ais_moderator(user)
+    # Счетчики тем и постов хранятся в самих строках
+    subsections = [subsection async for subsection in Subsection.objects.filter(section=section)]
     return render(request, 'forum/subsection_list.html', {'section': section, 'subsections': subsections,
     'is_moderator_or_admin': is_moderator_or_admin,  # Добавляем переменную в контекст
     })
 
 
-def topic_list(request, subsection_id):
-    subsection = Subsection.objects.get(id=subsection_id)
-    is_moderator_or_admin = request.user.groups.filter(name__in=['Admin', 'Moderator']).exists()
-    topics = Topic.objects.filter(subsection=subsection)
-    return render(request, 'forum/topic_list.html', {'subsection': subsection, 'topics': topics,
-    'is_moderator_or_admin': is_moderator_or_admin})
+# Закрепленные топики сверху, затем по последней активности; сортировку обслуживает индекс topic_activity_idx.
+# ?sort=views — по числу просмотров (индекс topic_views_idx)
+TOPIC_ORDERING = ('-is_pinned', '-last_post_at', '-id')
+TOPIC_VIEWS_ORDERING = ('-is_pinned', '-view_count', '-id')
+
+
+@cache_anonymous_page('subsection', 'subsection_id')
+async def topic_list(request, subsection_id):
+    user = await aresolve_user(request)
+    subsection = await aget_object_or_404(Subsection, id=subsection_id)
+    is_moderator_or_admin = await ais_moderator(user)
+    topics = (Topic.objects.filter(subsection=subsection)
+              .select_related('author', 'last_post__author')
+              .defer('content_html', 'last_post__content', 'last_post__content_html'))
+    topics = annotate_topic_unread(topics, user)
+    by_views = request.GET.get('sort') == 'views'
+    try:
+        page = await akeyset_paginate(topics, TOPIC_VIEWS_ORDERING if by_views else TOPIC_ORDERING,
+                                      settings.FORUM_TOPICS_PER_PAGE,
+                                      after=request.GET.get('after'), before=request.GET.get('before'))
+    except InvalidCursor:
+        raise Http404('Invalid page cursor')
+    for topic in page:
+        topic.views = viewcounts.approximate_views(topic)
+    return render(request, 'forum/topic_list.html', {'subsection': subsection, 'topics': page,
+    'is_moderator_or_admin': is_moderator_or_admin, 'by_views': by_views,
+    'pager_query': 'sort=views&' if by_views else ''})
 
 
 @login_required
 @user_passes_test(is_moderator)
+@atomic_on_write
 def warn_user(request, user_id):
     user = get_object_or_404(User, id=user_id)
 
@@ -249,6 +483,7 @@ def warn_user(request, user_id):
 # Модерация: бан пользователей
 @login_required
 @user_passes_test(is_moderator)
+@atomic_on_write
 def ban_user(request, user_id):
     user = get_object_or_404(User, id=user_id)
 
@@ -313,71 +548,141 @@ def manage_account(request):
     return render(request, 'forum/manage_account.html', context)
 
 
-def forum_stats(request):
-    # Общее количество разделов и подразделов
-    section_count = Section.objects.count()
-    subsection_count = Subsection.objects.count()
-
-    # Общее количество тем и сообщений
-    topic_count = Topic.objects.count()
-    post_count = Post.objects.count()
-
-    # Количество тем по разделам
-    topics_by_section = Section.objects.annotate(num_topics=models.Count('subsections__topics'))
-
-    # Количество тем по подразделам
-    topics_by_subsection = Subsection.objects.annotate(num_topics=models.Count('topics'))
-
-    context = {
-        'section_count': section_count,
-        'subsection_count': subsection_count,
-        'topic_count': topic_count,
-        'post_count': post_count,
-        'topics_by_section': topics_by_section,
-        'topics_by_subsection': topics_by_subsection
-    }
+async def forum_stats(request):
+    # Статистика берется из снимка в кэше и пересчитывается в фоне (см. stats.py)
+    await aresolve_user(request)
+    snapshot = await aget_stats_snapshot()
+    context = dict(snapshot['stats'])
+    context['stats_computed_at'] = snapshot['computed_at']
+    context['stats_age'] = int((timezone.now() - snapshot['computed_at']).total_seconds())
+    context['online_users'] = await activity.aonline_users()
     return render(request, 'forum/forum_stats.html', context)
 
 
-@login_required
-def conversation_list(request):
-    conversations = request.user.conversations.all()
-    return render(request, 'forum/conversation_list.html', {'conversations': conversations})
+def metrics(request):
+    # Агрегированные метрики запросов текущего процесса (см. middleware.py)
+    if not (settings.DEBUG or request.user.is_staff):
+        raise Http404
+    return JsonResponse({'views': metrics_registry.snapshot()})
+
+
+def search(request):
+    query = request.GET.get('q', '').strip()
+    try:
+        page = max(1, int(request.GET.get('page', 1)))
+    except ValueError:
+        page = 1
+    page = min(page, settings.FORUM_SEARCH_MAX_PAGES)  # Глубокие страницы ранжированной выдачи не нужны
+    per_page = settings.FORUM_SEARCH_RESULTS_PER_PAGE
+
+    results, has_next = [], False
+    if query:
+        results, has_next = forum_search.search(query, user=request.user, offset=(page - 1) * per_page,
+                                                limit=per_page)
+    return render(request, 'forum/search.html', {
+        'query': query,
+        'results': results,
+        'page': page,
+        'has_next': has_next and page < settings.FORUM_SEARCH_MAX_PAGES,
+        'has_previous': page > 1,
+        'search_available': forum_search.search_available(),
+    })
 
 
 @login_required
 def start_conversation(request, user_id):
     other_user = get_object_or_404(User, id=user_id)
 
-    # Найти или создать переписку с двумя участниками
-    conversation = Conversation.objects.filter(
-        participants=request.user
-    ).filter(
-        participants=other_user
-    ).annotate(num_participants=Count('participants')).filter(num_participants=2).first()
-
-    if not conversation:
-        conversation = Conversation.objects.create()
-        conversation.participants.add(request.user, other_user)
+    # Найти или создать переписку с двумя участниками по уникальному ключу пары.
+    # При гонке второй INSERT упадет на уникальном индексе, и get_or_create вернет уже созданную переписку.
+    pair_key = Conversation.make_pair_key(request.user.id, other_user.id)
+    with transaction.atomic():
+        conversation, created = Conversation.objects.get_or_create(pair_key=pair_key)
+        if created:
+            conversation.participants.add(request.user, other_user)
 
     return redirect('conversation_detail', conversation_id=conversation.id)
 
 @login_required
+@atomic_on_write
 def conversation_detail(request, conversation_id):
-    conversation = get_object_or_404(Conversation, id=conversation_id)
+    conversation = get_object_or_404(Conversation, id=conversation_id, participants=request.user)
 
     if request.method == 'POST':
         message_text = request.POST.get('message')
         if message_text:
             Message.objects.create(conversation=conversation, author=request.user, content=message_text)
+        return redirect('conversation_detail', conversation_id=conversation.id)
 
-    messages = conversation.messages.all().order_by('created_at')  # Получаем сообщения в порядке создания
+    # Рендерим только последнее окно сообщений, более старые клиент подгружает через conversation_messages
+    messages, has_older = fetch_messages(conversation.id, limit=settings.FORUM_QMS_WINDOW)
+    if messages:
+        mark_conversation_read(request.user, conversation, messages[-1].id)
     return render(request, 'forum/conversation_detail.html', {
         'conversation': conversation,
         'messages': messages,
+        'has_older': has_older,
+        'first_message_id': messages[0].id if messages else 0,
+        'last_message_id': messages[-1].id if messages else 0,  # С него клиент ждет новые сообщения
     })
 
+
+# JSON: сообщения после ?after=<id> (опрос новых) или перед ?before=<id> (история), не больше ?limit=
+@login_required
+def conversation_messages(request, conversation_id):
+    if not is_participant(request.user, conversation_id):
+        raise Http404
+    try:
+        after = int(request.GET['after']) if 'after' in request.GET else None
+        before = int(request.GET['before']) if 'before' in request.GET else None
+        limit = int(request.GET.get('limit', settings.FORUM_QMS_WINDOW))
+    except ValueError:
+        return JsonResponse({'error': 'after, before and limit must be integers'}, status=400)
+    limit = max(1, min(limit, settings.FORUM_QMS_BATCH_SIZE))
+
+    messages, has_more = fetch_messages(conversation_id, after=after, before=before, limit=limit)
+    return JsonResponse({
+        'messages': [serialize_message(message) for message in messages],
+        'has_more': has_more,
+    })
+
+
+# Long-poll для новых сообщений переписки (запасной вариант для клиентов без WebSocket).
+# Ответ приходит сразу, если есть сообщения после ?after=<id>, иначе — после уведомления хаба или по таймауту.
+@login_required
+async def conversation_poll(request, conversation_id):
+    user = await aresolve_user(request)
+    if not await ais_participant(user, conversation_id):
+        raise Http404
+    try:
+        after = int(request.GET.get('after', 0))
+    except ValueError:
+        after = 0
+
+    batch = await afetch_messages_after(conversation_id, after, settings.FORUM_QMS_BATCH_SIZE)
+    if not batch:
+        channel = conversation_channel(conversation_id)
+        if await get_hub().wait(channel, after, settings.FORUM_QMS_WAIT_TIMEOUT) is not None:
+            batch = await afetch_messages_after(conversation_id, after, settings.FORUM_QMS_BATCH_SIZE)
+    return JsonResponse({'messages': batch})
+
+
+# Входящие: переписки по времени последнего сообщения. Страница — один запрос с последним сообщением
+# и его автором (select_related) и счетчиком непрочитанных, плюс один prefetch участников.
+CONVERSATION_ORDERING = ('-last_message_at', '-id')
+
+
 @login_required
-def conversation_list(request):
-    conversations = Conversation.objects.filter(participants=request.user)
-    return render(request, 'forum/conversation_list.html', {'conversations': conversations})
\ No newline at end of file
+async def conversation_list(request):
+    user = await aresolve_user(request)
+    conversations = (Conversation.objects.filter(participants=user)
+                     .select_related('last_message__author')
+                     .defer('last_message__content_html')
+                     .prefetch_related(Prefetch('participants', queryset=User.objects.only('id', 'username'))))
+    conversations = annotate_conversation_unread(conversations, user)
+    try:
+        page = await akeyset_paginate(conversations, CONVERSATION_ORDERING, settings.FORUM_CONVERSATIONS_PER_PAGE,
+                                      after=request.GET.get('after'), before=request.GET.get('before'))
+    except InvalidCursor:
+        raise Http404('Invalid page cursor')
+    return render(request, 'forum/conversation_list.html', {'conversations': page})
\ No newline at end of file